@@ -14,6 +14,11 @@ The above copyright notice and this permission notice shall be included in all c
 THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 """
+import os
+import json
+import time
+import numpy as np
+from profiling import profiler
 
 ''' SUPERVISED ALGORITHMS '''
 
@@ -35,6 +40,19 @@ def model_KNN(data):
     
     return classifier_KNN
 
+''' K-NN with KD tree '''
+def model_KNN_Tree(data):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.neighbors import KNeighborsClassifier
+    
+    # Euclidean distance on standardized features allows KD tree index
+    # instead of brute-force search, queries run in parallel on all cores
+    classifier_KNN = make_pipeline(StandardScaler(), KNeighborsClassifier(n_neighbors = 5, algorithm = 'kd_tree', n_jobs = -1))
+    classifier_KNN.fit(data["X_train"], data["y_train"])
+    
+    return classifier_KNN
+
 ''' Kernel SVM '''
 def model_kSVM(data):
     from sklearn.svm import SVC
@@ -119,18 +137,373 @@ def model_HC(data):
     
     return y_pred
 
+''' UNSUPERVISED ALGORITHMS - LARGE DATASETS '''
+# Approximations of models whose memory or fit time grows quadratically
+# with number of flows
+
+''' One-class SVM with Nystroem kernel approximation '''
+def ocSVM_Nystroem(X):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.kernel_approximation import Nystroem
+    from sklearn.linear_model import SGDOneClassSVM
+    
+    # RBF kernel is approximated by 100 components and linear one-class SVM
+    # is trained on them, gamma is counted same as 'scale' in OneClassSVM
+    variance = X.var()
+    gamma = 1.0 / (X.shape[1] * variance) if variance > 0 else 1.0
+    
+    return make_pipeline(Nystroem(gamma = gamma, n_components = min(100, len(X)), random_state = 0), 
+                         SGDOneClassSVM(random_state = 0))
+
+def model_ocSVM_Nystroem(data):
+    ocSVM = ocSVM_Nystroem(data["X_test"])
+    y_pred = ocSVM.fit(data["X_test"]).predict(data["X_test"])
+    
+    return y_pred
+
+''' Local Outlier Factor with KD tree '''
+def LOF_Tree(novelty):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.neighbors import LocalOutlierFactor
+    
+    # Euclidean distance on standardized features allows KD tree instead
+    # of brute-force search needed by hamming metric
+    return make_pipeline(StandardScaler(), LocalOutlierFactor(algorithm = 'kd_tree', novelty = novelty))
+
+def model_LOF_Tree(data):
+    lof = LOF_Tree(novelty = False)
+    y_pred = lof.fit_predict(data["X_test"])
+    
+    return y_pred
+
+''' Hierarchical Clustering with Mini-Batch K-Means pre-clustering '''
+def HC_MiniBatch(X):
+    from sklearn.cluster import MiniBatchKMeans, AgglomerativeClustering
+    
+    # Flows are pre-clustered into 256 centroids, only the centroids are
+    # clustered by hierarchical clustering
+    mbk = MiniBatchKMeans(n_clusters = min(256, len(X)), batch_size = 4096, n_init = 1, random_state = 0)
+    mbk.fit(X)
+    hc = AgglomerativeClustering(n_clusters = 2, affinity = 'euclidean', linkage = 'ward')
+    centroid_clusters = hc.fit_predict(mbk.cluster_centers_)
+    
+    return centroid_clusters[mbk.labels_]
+
+def model_HC_MiniBatch(data):
+    y_pred = HC_MiniBatch(data["X_test"])
+    
+    return y_pred
+
+''' UNSUPERVISED ALGORITHMS - TRAINED DETECTORS '''
+# Detectors are fitted once on baseline traffic and saved, predictions
+# then only score new traffic by the fitted detector
+
+''' One-class SVM '''
+def detector_ocSVM(data):
+    from sklearn.svm import OneClassSVM
+    
+    ocSVM = OneClassSVM(kernel="rbf")
+    ocSVM.fit(data["X_train"])
+    
+    return ocSVM
+
+''' Isolation Forest '''
+def detector_iF(data):
+    from sklearn.ensemble import IsolationForest
+    
+    iF = IsolationForest(random_state=0)
+    iF.fit(data["X_train"])
+    
+    return iF
+
+''' Local Outlier Factor '''
+def detector_LOF(data):
+    from sklearn.neighbors import LocalOutlierFactor
+    
+    # Novelty mode allows to predict new traffic
+    lof = LocalOutlierFactor(metric = 'hamming', novelty = True)
+    lof.fit(data["X_train"])
+    
+    return lof
+
+''' K-Means Machine Learning Model '''
+def detector_KMeans(data):
+    from sklearn.cluster import KMeans
+    
+    # New traffic is assigned to the nearest centroid
+    kmeans = KMeans(n_clusters = 2, init = 'k-means++', algorithm = 'full', random_state = 42)
+    kmeans.fit(data["X_train"])
+    
+    return kmeans
+
+''' Hierarchical Clustering '''
+def detector_HC(data):
+    from sklearn.cluster import AgglomerativeClustering
+    from sklearn.neighbors import NearestCentroid
+    
+    hc = AgglomerativeClustering(n_clusters = 2, affinity = 'euclidean', linkage = 'ward')
+    clusters = hc.fit_predict(data["X_train"])
+    
+    # New traffic is assigned to the cluster with the nearest centroid
+    centroids = NearestCentroid()
+    centroids.fit(data["X_train"], clusters)
+    
+    return centroids
+
+''' One-class SVM with Nystroem kernel approximation '''
+def detector_ocSVM_Nystroem(data):
+    ocSVM = ocSVM_Nystroem(data["X_train"])
+    ocSVM.fit(data["X_train"])
+    
+    return ocSVM
+
+''' Local Outlier Factor with KD tree '''
+def detector_LOF_Tree(data):
+    lof = LOF_Tree(novelty = True)
+    lof.fit(data["X_train"])
+    
+    return lof
+
+''' Hierarchical Clustering with Mini-Batch K-Means pre-clustering '''
+def detector_HC_MiniBatch(data):
+    from sklearn.neighbors import NearestCentroid
+    
+    clusters = HC_MiniBatch(data["X_train"])
+    
+    # New traffic is assigned to the cluster with the nearest centroid
+    centroids = NearestCentroid()
+    centroids.fit(data["X_train"], clusters)
+    
+    return centroids
+
+''' INCREMENTAL ALGORITHMS '''
+# Models trained by chunks of the dataset, every call of partial_fit updates
+# the model by one chunk, so new traffic is added to the saved model without
+# training it again on all previous datasets
+
+# Number of randomly sampled rows of every class kept by incremental models
+# for later chunks, e.g. chunks without that class
+INCREMENTAL_RESERVOIR = 10000
+
+class IncrementalReservoir:
+    # Random sample of rows of every class seen by partial_fit (reservoir),
+    # so models trained by chunks of time-ordered traffic (e.g. benign-only
+    # day followed by attack) do not forget classes of previous chunks
+
+    def __init__(self, reservoir=INCREMENTAL_RESERVOIR):
+        self.reservoir = reservoir
+        self.rng = np.random.default_rng(0)
+        # Kept rows, their labels and random priorities of every class
+        self.kept = {}
+
+    # Method to update random sample of rows of every class, rows with the
+    # lowest random priorities of all seen rows are kept
+    def keep_rows(self, X, y):
+        for label in np.unique(y):
+            X_class = X[y == label]
+            priority = self.rng.random(len(X_class))
+            if label in self.kept:
+                X_kept, kept_priority = self.kept[label]
+                X_class = np.concatenate([X_kept, X_class])
+                priority = np.concatenate([kept_priority, priority])
+            if len(X_class) > self.reservoir:
+                rows = np.argpartition(priority, self.reservoir - 1)[:self.reservoir]
+                X_class, priority = X_class[rows], priority[rows]
+            self.kept[label] = (X_class, priority)
+
+    # Method to add kept rows of the classes to the chunk, at most count rows
+    # of every class are drawn randomly
+    def replay_rows(self, X, y, labels, count=None):
+        for label in labels:
+            X_kept = self.kept[label][0]
+            if count is not None and count < len(X_kept):
+                X_kept = X_kept[self.rng.choice(len(X_kept), count, replace=False)]
+            X = np.concatenate([X, X_kept])
+            y = np.concatenate([y, np.full(len(X_kept), label, dtype=y.dtype)])
+        return X, y
+
+class IncrementalModel(IncrementalReservoir):
+    # Standardization updated by every chunk followed by estimator trained
+    # by its partial_fit, classes are None for unsupervised estimators.
+    # Gradient descent follows order of the rows, so with replay every chunk
+    # is mixed with kept rows of previous chunks and shuffled
+
+    def __init__(self, estimator, scale=False, classes=None, replay=False):
+        from sklearn.preprocessing import StandardScaler
+
+        super().__init__()
+        self.estimator = estimator
+        self.scaler = StandardScaler() if scale else None
+        self.classes = classes
+        self.replay = replay
+        self.chunks = 0
+        self.samples = 0
+
+    def partial_fit(self, X, y=None):
+        if len(X) == 0:
+            return self
+        samples = len(X)
+        if self.scaler is not None:
+            self.scaler.partial_fit(X)
+        if self.replay:
+            # Rows of previous chunks are drawn before the chunk is kept,
+            # they are kept unscaled and scaled by the current statistics
+            kept = list(self.kept)
+            self.keep_rows(X, y)
+            X, y = self.replay_rows(X, y, kept, max(1, samples // self.classes.size))
+            order = self.rng.permutation(len(X))
+            X, y = X[order], y[order]
+        if self.scaler is not None:
+            X = self.scaler.transform(X)
+        if self.classes is None:
+            self.estimator.partial_fit(X)
+        else:
+            self.estimator.partial_fit(X, y, classes=self.classes)
+        self.chunks = self.chunks + 1
+        self.samples = self.samples + samples
+        return self
+
+    def predict(self, X):
+        if self.scaler is not None:
+            X = self.scaler.transform(X)
+        return self.estimator.predict(X)
+
+class IncrementalForest(IncrementalReservoir):
+    # Random forest with warm start, every chunk adds new trees trained only
+    # on that chunk. Kept rows of every class are added to chunks with one
+    # class (e.g. benign-only day), so trees always learn both classes.
+    # Trees are not added until both classes were seen
+
+    def __init__(self, trees_per_chunk=10, reservoir=INCREMENTAL_RESERVOIR):
+        from sklearn.ensemble import RandomForestClassifier
+
+        super().__init__(reservoir)
+        self.forest = RandomForestClassifier(n_estimators = 0, criterion = 'entropy', warm_start = True, random_state = 0)
+        self.trees_per_chunk = trees_per_chunk
+        self.classes = np.array([0, 1])
+        self.chunks = 0
+        self.samples = 0
+
+    def partial_fit(self, X, y):
+        self.keep_rows(X, y)
+        if len(self.kept) < self.classes.size:
+            return self
+
+        samples = len(X)
+        X, y = self.replay_rows(X, y, np.setdiff1d(self.classes, y))
+
+        self.forest.n_estimators = self.forest.n_estimators + self.trees_per_chunk
+        self.forest.fit(X, y)
+        self.chunks = self.chunks + 1
+        self.samples = self.samples + samples
+        return self
+
+    def predict(self, X):
+        return self.forest.predict(X)
+
+''' Logistic Regression trained by SGD '''
+def incremental_LR():
+    from sklearn.linear_model import SGDClassifier
+
+    # Kept rows are replayed, so the model does not follow only the last chunks
+    # of time-ordered traffic. Weights are not averaged, average of weights
+    # fitted before both classes were seen is worse than the last weights
+    return IncrementalModel(SGDClassifier(loss = 'log_loss', penalty = 'l2', random_state = 0),
+                            scale = True, classes = np.array([0, 1]), replay = True)
+
+''' Naive Bayes '''
+def incremental_NB():
+    from sklearn.naive_bayes import GaussianNB
+
+    return IncrementalModel(GaussianNB(), classes = np.array([0, 1]))
+
+''' Random Forest Classification with warm start '''
+def incremental_RFC():
+    return IncrementalForest(trees_per_chunk = 10)
+
+''' Mini-Batch K-Means '''
+def incremental_KMeans():
+    from sklearn.cluster import MiniBatchKMeans
+
+    return IncrementalModel(MiniBatchKMeans(n_clusters = 2, random_state = 42, n_init = 3))
+
 ''' NEURAL NETWORKS '''
+# Neural network is trained by large batches on features standardized by its
+# first layer, training stops when loss of the validation set stops improving
+
+# Default training parameters of neural network
+ANN_BATCH_SIZE = 1024
+ANN_EPOCHS = 100
+ANN_PATIENCE = 3
+ANN_VALIDATION_SPLIT = 0.1
+
+# Method to count standardization statistics of the training set, chunks
+# saved on disk are read one by one
+def ANN_scaler(data):
+    from sklearn.preprocessing import StandardScaler
+    
+    scaler = StandardScaler()
+    if "chunks" in data:
+        for X_filename, _ in data["chunks"]:
+            scaler.partial_fit(np.load(X_filename, mmap_mode='r'))
+    else:
+        scaler.fit(data["X_train"])
+    return scaler
+
+# Method to create input pipeline of the training set on disk, chunks and
+# rows of every chunk are shuffled in every epoch, next batch is prepared
+# while the current one is trained
+def ANN_batches(chunks, batch_size, n_features):
+    import tensorflow as tf
+    
+    rng = np.random.default_rng(0)
+    def batches():
+        for i in rng.permutation(len(chunks)):
+            X_chunk = np.load(chunks[i][0])
+            y_chunk = np.load(chunks[i][1])
+            order = rng.permutation(len(X_chunk))
+            for start in range(0, len(order), batch_size):
+                rows = order[start:start + batch_size]
+                yield X_chunk[rows], y_chunk[rows]
+    
+    signature = (tf.TensorSpec(shape=(None, n_features), dtype=tf.float32),
+                 tf.TensorSpec(shape=(None,), dtype=tf.uint8))
+    return tf.data.Dataset.from_generator(batches, output_signature=signature).prefetch(tf.data.AUTOTUNE)
+
+# Method to check if checkpoint was saved by training on the same data, key
+# describing the training is saved next to the checkpoint. Checkpoint of
+# other training (other dataset, split or features) is removed
+def ANN_checkpoint_matches(checkpoint, key):
+    key_filename = f"{checkpoint}.json"
+    try:
+        with open(key_filename) as f:
+            saved_key = json.load(f)
+    except (FileNotFoundError, ValueError):
+        saved_key = None
+    
+    if os.path.isfile(checkpoint) and saved_key == json.loads(json.dumps(key)):
+        return True
+    if os.path.isfile(checkpoint):
+        print(f"Checkpoint {checkpoint} was saved by training on other data, training starts from the beginning")
+    for filename in (checkpoint, key_filename):
+        if os.path.isfile(filename):
+            os.remove(filename)
+    return False
 
 ''' ARTIFICIAL NEURAL NETWORK MODEL '''
-def model_ANN(data):
+def build_ANN(scaler):
     from keras.models import Sequential
-    from keras.layers import Dense
+    from keras.layers import Dense, Normalization
     
     # Initialising the ANN
     classifier_ANN = Sequential()
     
-    # Adding the input layer and the first hidden layer
-    classifier_ANN.add(Dense(activation="relu", input_dim=79, units=39, kernel_initializer="uniform"))
+    # Adding the input layer standardizing features, constant features are only centered
+    classifier_ANN.add(Normalization(input_shape=(scaler.n_features_in_,), mean=scaler.mean_, variance=scaler.scale_**2))
+    
+    # Adding the first hidden layer
+    classifier_ANN.add(Dense(activation="relu", units=39, kernel_initializer="uniform"))
     
     # Adding the hidden layers
     h_layers = 10
@@ -143,8 +516,109 @@ def model_ANN(data):
     # Compiling the ANN
     classifier_ANN.compile(optimizer = 'adam', loss = 'sparse_categorical_crossentropy', metrics = ['accuracy'])
     
+    return classifier_ANN
+
+def model_ANN(data, batch_size=ANN_BATCH_SIZE, epochs=ANN_EPOCHS, patience=ANN_PATIENCE, checkpoint=None, checkpoint_key=None):
+    from keras.callbacks import EarlyStopping, ModelCheckpoint, LambdaCallback
+    from keras.models import load_model
+    from sklearn.model_selection import train_test_split
+    
+    # Training set is either in memory or saved on disk by chunks with
+    # validation set held out in memory
+    if "chunks" in data:
+        X_val, y_val = data["X_val"], data["y_val"]
+        samples = data["samples"]
+    else:
+        X_train, X_val, y_train, y_val = train_test_split(data["X_train"], data["y_train"], test_size = ANN_VALIDATION_SPLIT, random_state = 0)
+        samples = len(X_train)
+    
+    # Training continues from the checkpoint of interrupted training on the
+    # same data with the same number of features
+    key = dict(checkpoint_key or {}, features=int(X_val.shape[1]))
+    if checkpoint is not None and ANN_checkpoint_matches(checkpoint, key):
+        print(f"Training of the ANN continues from checkpoint {checkpoint}")
+        classifier_ANN = load_model(checkpoint)
+    else:
+        with profiler.stage("scale", samples):
+            classifier_ANN = build_ANN(ANN_scaler(data))
+        if checkpoint is not None:
+            os.makedirs(os.path.dirname(checkpoint) or ".", exist_ok=True)
+            with open(f"{checkpoint}.json", 'w') as f:
+                json.dump(key, f, indent=4)
+    
+    # Stopping when validation loss does not improve, weights of the best
+    # epoch are kept and saved into the checkpoint
+    callbacks = [EarlyStopping(monitor = 'val_loss', patience = patience, restore_best_weights = True)]
+    if checkpoint is not None:
+        callbacks.append(ModelCheckpoint(checkpoint, monitor = 'val_loss', save_best_only = True))
+    
+    # Throughput of every epoch
+    epoch_started = {}
+    def epoch_begin(epoch, logs):
+        epoch_started["wall"] = time.perf_counter()
+        epoch_started["cpu"] = time.process_time()
+    def epoch_end(epoch, logs):
+        wall = time.perf_counter() - epoch_started["wall"]
+        profiler.add("epoch", wall, time.process_time() - epoch_started["cpu"], samples)
+        print(f"Epoch {epoch + 1}: {samples / wall:.0f} samples/s, loss {logs['loss']:.4f}, validation loss {logs['val_loss']:.4f}")
+    callbacks.append(LambdaCallback(on_epoch_begin = epoch_begin, on_epoch_end = epoch_end))
+    
     # Fitting the ANN to the Training set
-    classifier_ANN.fit(data["X_train"], data["y_train"], batch_size = 10, epochs = 10)
+    if "chunks" in data:
+        batches = ANN_batches(data["chunks"], batch_size, X_val.shape[1])
+        classifier_ANN.fit(batches, epochs = epochs, validation_data = (X_val, y_val), callbacks = callbacks, verbose = 0)
+    else:
+        classifier_ANN.fit(X_train, y_train, batch_size = batch_size, epochs = epochs, validation_data = (X_val, y_val), callbacks = callbacks, verbose = 0)
+    
+    # Checkpoint is not needed after finished training
+    if checkpoint is not None:
+        for filename in (checkpoint, f"{checkpoint}.json"):
+            if os.path.isfile(filename):
+                os.remove(filename)
     
     return classifier_ANN
 
+''' ML MODELS '''
+
+# Definition of ML models - groups differ in training and prediction
+supervised = ("LR", "K-NN", "kSVM", "NB", "DTC", "RFC", "K-NN-Tree")
+unsupervised = ("ocSVM", "iF", "LOF", "K-Means", "HC", "ocSVM-Nystroem", "LOF-Tree", "HC-MB")
+deepLearning = ("ANN",)
+
+# ML models comparing flows by hamming metric, i.e. by count of equal features
+hamming = ("K-NN", "LOF")
+
+# Assigning ML models to their flags
+models = {"LR": model_LR, "K-NN": model_KNN, "kSVM":  model_kSVM, 
+           "NB": model_NB, "DTC":  model_DTC, "RFC":  model_RFC, 
+           "ocSVM":  model_ocSVM, "iF": model_iF, "LOF": model_LOF, 
+           "K-Means":  model_KMeans, "HC": model_HC, "ANN":  model_ANN, 
+           "ocSVM-Nystroem": model_ocSVM_Nystroem, "LOF-Tree": model_LOF_Tree, 
+           "HC-MB": model_HC_MiniBatch, "K-NN-Tree": model_KNN_Tree}
+
+# Assigning trained detectors to unsupervised ML models
+detectors = {"ocSVM": detector_ocSVM, "iF": detector_iF, "LOF": detector_LOF, 
+             "K-Means": detector_KMeans, "HC": detector_HC, 
+             "ocSVM-Nystroem": detector_ocSVM_Nystroem, "LOF-Tree": detector_LOF_Tree, 
+             "HC-MB": detector_HC_MiniBatch}
+
+# Assigning incremental variants to ML models which can be trained by chunks
+incremental = {"LR": incremental_LR, "NB": incremental_NB, "RFC": incremental_RFC,
+               "K-Means": incremental_KMeans}
+
+# Method to convert predictions of unsupervised models into labels,
+# inliers (1) are not anomaly
+def unsupervised_labels(y_pred):
+    return np.where(y_pred == 1, 0, 1)
+
+# Method to predict labels by loaded classifier
+def predict_classifier(classifier, model, X):
+    with profiler.stage("predict", len(X)):
+        y_pred = classifier.predict(X)
+        if model in deepLearning:
+            y_pred = (y_pred > 0.5)
+            # Invert back to numbers
+            y_pred = np.argmax(y_pred, axis = 1)
+        elif model in unsupervised:
+            y_pred = unsupervised_labels(y_pred)
+    return y_pred
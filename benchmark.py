@@ -0,0 +1,185 @@
+"""
+BENCHMARK
+System Log Analysis for Anomaly Detection Using Machine Learning
+MIT License
+Copyright (c) 2020 Miroslav Siklosi
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import sklearn
+import ML_modules as ML
+from data_preprocessing import FEATURE_COLUMNS, IMPUTED_COLUMNS, fit_imputer, apply_imputer, import_dataset, hash_file
+from data_output import compute_metrics, open_labelled_file, write_labelled_dataset, write_prediction_result
+
+# ML models benchmarked by default, models with quadratic fit are left out
+default_models = ("LR", "NB", "DTC", "RFC", "K-NN-Tree", "iF", "K-Means", "HC-MB", "ocSVM-Nystroem")
+
+# Method to generate synthetic flows with the same columns as CICIDS2017
+# dataset, rows of the template dataset are resampled and their features
+# randomly scaled, so the value distributions stay realistic. Flows are
+# written into temporary file first, so interrupted generation is not reused
+def generate_flows(filename, rows, template, seed=0, chunksize=100000):
+    rng = np.random.default_rng(seed)
+    template = pd.read_csv(template)
+    feature_names = template.columns[FEATURE_COLUMNS]
+    flow_bytes, flow_packets = (feature_names[j] for j in IMPUTED_COLUMNS)
+    # Destination Port and Protocol are kept as they are
+    scaled_names = feature_names[2:]
+
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, 'w', newline='') as f:
+        for start in range(0, rows, chunksize):
+            count = min(chunksize, rows - start)
+            chunk = template.iloc[rng.integers(0, len(template), count)].reset_index(drop=True)
+
+            # Features are scaled by random factor, integer columns stay integers
+            for name in scaled_names:
+                values = chunk[name].to_numpy()
+                scaled = values * rng.lognormal(0.0, 0.1, count)
+                chunk[name] = np.rint(scaled).astype(values.dtype) if values.dtype.kind in "iu" else scaled
+
+            # Unique flows
+            index = np.arange(start, start + count)
+            source_ip = "10." + pd.Series(index // 65536 % 256).astype(str) + "." + pd.Series(index // 256 % 256).astype(str) + "." + pd.Series(index % 256).astype(str)
+            chunk.iloc[:, 0] = source_ip + "-" + chunk.iloc[:, 3].astype(str) + "-" + pd.Series(index).astype(str)
+            chunk.iloc[:, 1] = source_ip
+
+            # Missing and infinite values as in CICIDS2017
+            chunk.loc[rng.random(count) < 0.001, flow_bytes] = np.nan
+            chunk.loc[rng.random(count) < 0.001, flow_packets] = np.inf
+
+            chunk.to_csv(f, header=(start == 0), index=False, na_rep="NaN")
+    os.replace(tmp_filename, filename)
+
+# Method to measure wall-clock time of the stage, the best of repeats is kept
+def measure(stages, name, function, repeat=1):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    stages[name] = best
+    print(f"{name:32s} {best:10.4f} s")
+    return result
+
+# Method to benchmark every stage of the pipeline on one dataset
+def benchmark_dataset(filename, model_list, repeat, output_dir):
+    stages = {}
+
+    # Import of the dataset
+    dataset = measure(stages, "read_csv", lambda: pd.read_csv(filename), repeat)
+    X = dataset.iloc[:, FEATURE_COLUMNS].to_numpy(dtype=np.float32)
+    measure(stages, "imputation", lambda: apply_imputer(X.copy(), fit_imputer(X)), repeat)
+    data = measure(stages, "import_dataset", lambda: import_dataset(filename, split=True, keep_dataset=False), repeat)
+
+    # Training and prediction
+    y_pred = None
+    for model in model_list:
+        if model in ML.unsupervised:
+            y_model = measure(stages, f"fit_predict:{model}", lambda: ML.unsupervised_labels(ML.models[model]({"X_test": data["X_test"]})), repeat)
+        else:
+            classifier = measure(stages, f"fit:{model}", lambda: ML.models[model](data), repeat)
+            y_model = measure(stages, f"predict:{model}", lambda: ML.predict_classifier(classifier, model, data["X_test"]), repeat)
+        y_pred = y_model if y_pred is None else y_pred
+        print(f"{'accuracy:' + model:32s} {compute_metrics(data['y_test'], y_model)['accuracy']:10.4f}")
+
+    # Writing of results, predictions of the first model are written
+    # for the whole dataset
+    if y_pred is not None:
+        labels = np.resize(y_pred, len(dataset))
+        y = (dataset.iloc[:, -1].values != "BENIGN").astype(np.uint8)
+        measure(stages, "compute_metrics", lambda: compute_metrics(y, labels), repeat)
+
+        def write_labelled():
+            with open_labelled_file(os.path.join(output_dir, "labelled.csv")) as f:
+                write_labelled_dataset(f, dataset, labels)
+        measure(stages, "write_labelled_dataset", write_labelled, repeat)
+        measure(stages, "write_prediction_result", lambda: write_prediction_result(os.path.join(output_dir, "prediction_result.csv"), dataset, y, labels), repeat)
+
+    return stages
+
+# Method to compare benchmark with baseline, stages slower than tolerance are
+# regressions, stages faster than min_time are too noisy to be compared
+def compare_with_baseline(results, baseline, tolerance, min_time=0.01):
+    regressions = []
+    print(f"\n{'stage':40s} {'baseline':>10s} {'current':>10s} {'ratio':>8s}")
+    for rows, stages in results["datasets"].items():
+        baseline_stages = baseline["datasets"].get(rows, {})
+        for name, elapsed in stages.items():
+            if name not in baseline_stages:
+                continue
+            ratio = elapsed / baseline_stages[name] if baseline_stages[name] else float("inf")
+            flag = ""
+            if ratio > 1 + tolerance and elapsed >= min_time:
+                flag = "REGRESSION"
+                regressions.append(f"{rows}/{name}")
+            print(f"{rows + '/' + name:40s} {baseline_stages[name]:10.4f} {elapsed:10.4f} {ratio:8.2f} {flag}")
+    return regressions
+
+if __name__ == "__main__":
+    # Create parser
+    parser = argparse.ArgumentParser(prog="benchmark.py")
+    parser.add_argument("--rows", dest="rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--models", dest="models", nargs="+", default=list(default_models))
+    parser.add_argument("--template", dest="template", default="Datasets/sample_data2.csv")
+    parser.add_argument("--data-dir", dest="data_dir", default=tempfile.gettempdir())
+    parser.add_argument("--seed", dest="seed", type=int, default=0)
+    parser.add_argument("--repeat", dest="repeat", type=int, default=1)
+    parser.add_argument("--output", dest="output", default="benchmark.json")
+    parser.add_argument("--baseline", dest="baseline", default=None)
+    parser.add_argument("--tolerance", dest="tolerance", type=float, default=0.2)
+    parser.add_argument("--min-time", dest="min_time", type=float, default=0.01)
+    args = parser.parse_args()
+
+    unknown = [model for model in args.models if model not in ML.models]
+    if unknown:
+        print(f"Unknown ML models {', '.join(unknown)}, choose from {', '.join(ML.models)}")
+        sys.exit(1)
+
+    results = {"environment": {"python": platform.python_version(),
+                               "numpy": np.__version__,
+                               "pandas": pd.__version__,
+                               "sklearn": sklearn.__version__,
+                               "machine": platform.machine(),
+                               "cpus": os.cpu_count()},
+               "seed": args.seed,
+               "models": args.models,
+               "datasets": {}}
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    # Generated datasets are reused by following runs with the same seed and
+    # template, so they are named by template and hash of its content
+    template_name = os.path.splitext(os.path.basename(args.template))[0]
+    template_hash = hash_file(args.template)[:8]
+    output_dir = tempfile.mkdtemp(prefix="traffic_analysis_benchmark_")
+    for rows in args.rows:
+        filename = os.path.join(args.data_dir, f"synthetic_flows_{template_name}_{template_hash}_{rows}_{args.seed}.csv")
+        if not os.path.isfile(filename):
+            print(f"Generating {rows} synthetic flows into {filename}")
+            generate_flows(filename, rows, args.template, args.seed)
+
+        print(f"\nBenchmark of dataset with {rows} flows")
+        results["datasets"][str(rows)] = benchmark_dataset(filename, args.models, args.repeat, output_dir)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"\nBenchmark saved into {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance, args.min_time)
+        if regressions:
+            print(f"\nStages slower than baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
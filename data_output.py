@@ -0,0 +1,94 @@
+"""
+DATA OUTPUT
+System Log Analysis for Anomaly Detection Using Machine Learning
+MIT License
+Copyright (c) 2020 Miroslav Siklosi
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import csv
+import json
+import numpy as np
+import pandas as pd
+from data_preprocessing import FLOW_ID_COLUMN
+
+# Formats of labelled dataset
+# tsv - whole dataset and label, values separated by tab and space
+# csv - whole dataset and label in CSV format with header
+# flowid - Flow ID and label, values separated by tab and space
+# label - label only
+output_formats = ("tsv", "csv", "flowid", "label")
+
+# Columns of the dataset needed by each format, None is the whole dataset
+output_columns = {"tsv": None, "csv": None, "flowid": [FLOW_ID_COLUMN], "label": []}
+
+# Method for converting predictions into labels
+def predictions_to_labels(y_pred):
+    return np.where(np.asarray(y_pred).astype(bool), "Anomaly", "Not anomaly")
+
+# Method to open text file for labelled dataset, lines are terminated by pandas
+def open_labelled_file(filename, mode='w'):
+    return open(filename, mode, newline='')
+
+# Method to write dataset labelled by predictions into the opened text file
+def write_labelled_dataset(f, dataset, y_pred, output_format="tsv", header=False):
+    labels = predictions_to_labels(y_pred)
+
+    if output_format == "label":
+        pd.Series(labels).to_csv(f, header=False, index=False)
+    elif output_format == "csv":
+        labelled_dataset = dataset.assign(Prediction=labels)
+        labelled_dataset.to_csv(f, header=header, index=False, na_rep='nan')
+    else:
+        if output_format == "flowid":
+            labelled_dataset = pd.DataFrame({"Flow ID": dataset.iloc[:, 0].values, "Prediction": labels})
+        else:
+            labelled_dataset = dataset.assign(Prediction=labels)
+        # Values are written same way as numpy prints them, separated by tab and space
+        text = labelled_dataset.to_csv(sep='\t', header=False, index=False, na_rep='nan', quoting=csv.QUOTE_NONE, escapechar='\\')
+        f.write(text.replace('\t', '\t '))
+
+# Method to count confusion matrix and metrics of predictions in one pass
+def compute_metrics(y_test, y_pred):
+    y_test = np.asarray(y_test).astype(bool).astype(np.int64)
+    y_pred = np.asarray(y_pred).astype(bool).astype(np.int64)
+    
+    # [[tn, fp], [fn, tp]]
+    cm = np.bincount(2 * y_test + y_pred, minlength=4).reshape(2, 2)
+    tn, fp, fn, tp = cm.ravel()
+    
+    # accuracy: (tp + tn) / (p + n)
+    accuracy = (tp + tn) / cm.sum() if cm.sum() else 0.0
+    # precision tp / (tp + fp)
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    # recall: tp / (tp + fn)
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    # f1: 2 precision recall / (precision + recall)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    
+    return {"confusion_matrix": cm, "accuracy": accuracy, "precision": precision, 
+            "recall": recall, "f1": f1}
+
+# Method to save metrics into JSON file
+def save_metrics(filename, model, metrics):
+    with open(filename, 'w') as f:
+        json.dump(metrics_report(model, metrics), f, indent=4)
+
+# Method to convert metrics into report which can be saved as JSON
+def metrics_report(model, metrics):
+    return {"model": model,
+            "confusion_matrix": metrics["confusion_matrix"].tolist(),
+            "accuracy": float(metrics["accuracy"]),
+            "precision": float(metrics["precision"]),
+            "recall": float(metrics["recall"]),
+            "f1": float(metrics["f1"])}
+
+# Method to write dataset with predictions and their correctness into the text file
+def write_prediction_result(filename, dataset, y_test, y_pred):
+    # [dataset, y_pred] Prediction is correct/Prediction is NOT correct
+    y_pred = np.asarray(y_pred)
+    correct = np.where(np.asarray(y_test) == y_pred, " Prediction is correct", " Prediction is NOT correct")
+    result = dataset.assign(**{"Prediction": np.char.add(" ", y_pred.astype(str)), "Result": correct})
+    with open_labelled_file(filename) as f:
+        result.to_csv(f, header=False, index=False)
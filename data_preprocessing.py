@@ -7,78 +7,415 @@ Permission is hereby granted, free of charge, to any person obtaining a copy of
 The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
 THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
+import os
+import glob
+import json
+import shutil
+import hashlib
+import multiprocessing
+from functools import partial
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
+from profiling import profiler
 
-# Method for importing unlabelled dataset
-def import_unlabelled_dataset(filename):
-    # Load the dataset
-    dataset = pd.read_csv(filename)
+# Columns of the dataset used as matrix of independant variables
+FEATURE_COLUMNS = list(range(4, 6)) + list(range(7, 84))
+
+# Column of the dataset with Flow ID
+FLOW_ID_COLUMN = 0
+
+# Columns of the feature matrix which can contain NaN or Infinity values
+# (Flow Bytes/s and Flow Packets/s)
+IMPUTED_COLUMNS = [15, 16]
+
+# Method for fitting imputation statistics (average and maximum) of columns
+def fit_imputer(X, columns=IMPUTED_COLUMNS):
+    values = X[:, columns].astype(np.float64)
+    valid = values[np.isfinite(values)]
+    
+    # Average and maximum are counted together over all imputed columns
+    AVERAGE = valid.mean() if valid.size else 0.0
+    MAX = max(valid.max(), 0.0) if valid.size else 0.0
     
-    # Load dataset into matrix of independant variables 
-    X_test = dataset.iloc[:, list(range(4, 6)) + list(range(7, 84))].values
+    return {"columns": list(columns), "average": AVERAGE, "max": MAX}
 
-    # Taking care of missing and incorrect data
-    SUM = 0
-    MAX = 0
+# Method for counting imputation statistics of part of the dataset, parts
+# are merged into statistics of the whole dataset by merge_imputer
+def imputer_statistics(X, columns=IMPUTED_COLUMNS):
+    values = X[:, columns].astype(np.float64)
+    valid = values[np.isfinite(values)]
+    
+    return {"sum": valid.sum(), "count": valid.size, "max": valid.max() if valid.size else 0.0}
+
+# Method for merging imputation statistics of parts of the dataset
+def merge_imputer(statistics, columns=IMPUTED_COLUMNS):
+    SUM = 0.0
+    MAX = 0.0
     COUNT = 0
+    for part in statistics:
+        if part["count"]:
+            SUM = SUM + part["sum"]
+            MAX = max(MAX, part["max"])
+            COUNT = COUNT + part["count"]
+    
+    AVERAGE = SUM/COUNT if COUNT else 0.0
+    
+    return {"columns": list(columns), "average": AVERAGE, "max": MAX}
+
+# Method for replacing NaN values by average and Infinity values by maximum
+def apply_imputer(X, imputer):
+    columns = imputer["columns"]
+    values = X[:, columns].astype(np.float64)
+    values[np.isnan(values)] = imputer["average"]
+    values[np.isposinf(values)] = imputer["max"]
+    X[:, columns] = values
     
-    # Count average values in columns 15 and 16
-    for i, row in enumerate(X_test):
-        for j in [15, 16]:
-            sx = str(float(X_test[i,j])).lower()
-            if  (sx != "nan" and sx != "inf"):
-                SUM = SUM + X_test[i,j]
-                if X_test[i,j] > MAX:
-                    MAX = X_test[i,j]
-                COUNT = COUNT + 1
+    return X
+
+# Methods of feature reduction, applied in given order
+REDUCTION_METHODS = ("variance", "correlation", "importance", "pca")
+
+# Parameters of feature reduction: features with variance not above threshold
+# are removed, of features correlated more than threshold only the first one
+# is kept, the most important features of Random Forest and principal
+# components are kept until they cover the ratio of importance or variance
+VARIANCE_THRESHOLD = 0.0
+CORRELATION_THRESHOLD = 0.95
+IMPORTANCE_RATIO = 0.99
+PCA_VARIANCE_RATIO = 0.99
+
+# Number of rows of the training dataset randomly sampled for fitting of
+# feature reduction
+REDUCTION_SAMPLE = 100000
+
+# Method for fitting feature reduction, result is saved with the classifier
+# and is readable as JSON
+def fit_reduction(X, y, methods):
+    rng = np.random.default_rng(0)
+    rows = np.sort(rng.choice(len(X), REDUCTION_SAMPLE, replace=False)) if len(X) > REDUCTION_SAMPLE else slice(None)
+    sample = np.asarray(X[rows], dtype=np.float64)
+    columns = np.arange(X.shape[1])
+    pca = None
     
-    AVERAGE = SUM/COUNT
+    for method in methods:
+        if method == "variance":
+            columns = columns[sample[:, columns].var(axis=0) > VARIANCE_THRESHOLD]
+        elif method == "correlation":
+            # Constant features are not correlated with any other
+            with np.errstate(invalid='ignore', divide='ignore'):
+                correlation = np.nan_to_num(np.abs(np.corrcoef(sample[:, columns], rowvar=False)))
+            kept = []
+            for i in range(len(columns)):
+                if not kept or correlation[i, kept].max() <= CORRELATION_THRESHOLD:
+                    kept.append(i)
+            columns = columns[kept]
+        elif method == "importance":
+            from sklearn.ensemble import RandomForestClassifier
+            forest = RandomForestClassifier(n_estimators = 20, criterion = 'entropy', random_state = 0)
+            forest.fit(sample[:, columns], np.asarray(y[rows]))
+            order = np.argsort(forest.feature_importances_)[::-1]
+            count = np.searchsorted(np.cumsum(forest.feature_importances_[order]), IMPORTANCE_RATIO) + 1
+            columns = np.sort(columns[order[:count]])
+        elif method == "pca":
+            # Principal components of standardized features
+            mean = sample[:, columns].mean(axis=0)
+            scale = sample[:, columns].std(axis=0)
+            scale[scale == 0.0] = 1.0
+            _, singular, components = np.linalg.svd((sample[:, columns] - mean) / scale, full_matrices=False)
+            ratio = np.cumsum(singular**2) / np.sum(singular**2)
+            count = min(int(np.searchsorted(ratio, PCA_VARIANCE_RATIO)) + 1, len(singular))
+            pca = {"mean": mean.tolist(), "scale": scale.tolist(), "components": components[:count].tolist()}
     
-    for i, row in enumerate(X_test):
-        for j in [15, 16]:
-            sx = str(float(X_test[i,j])).lower()
-            if  sx == "nan":
-                X_test[i, j] = AVERAGE    
-            if  sx == "inf":
-                X_test[i, j] = MAX
+    return {"methods": list(methods), "columns": columns.tolist(), "pca": pca}
+
+# Method for applying feature reduction to matrix of independant variables
+def apply_reduction(X, reduction):
+    X = X[:, reduction["columns"]]
+    pca = reduction["pca"]
+    if pca is not None:
+        X = ((X - np.asarray(pca["mean"])) / np.asarray(pca["scale"])) @ np.asarray(pca["components"]).T
     
-    return {"dataset": dataset, "X_test": X_test}
+    return np.ascontiguousarray(X, dtype=np.float32)
 
-# Method for importing labelled dataset
-def import_dataset(filename, split):    
+# Default size limit of the dataset cache in bytes
+CACHE_SIZE = 4 * 1024**3
+
+# Version of the layout of cache entries, entries of other layout are removed
+CACHE_FORMAT = 2
+
+# Method to get schema of cleaned feature matrix, entries cleaned with other
+# schema are not loaded
+def cache_schema():
+    return {"format": CACHE_FORMAT, "dtype": "float32",
+            "feature_columns": FEATURE_COLUMNS, "imputed_columns": IMPUTED_COLUMNS}
+
+# Method for hashing content of dataset file
+def hash_file(filename, blocksize=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+# Method to replace folder by new one written into temporary folder, the old
+# folder is renamed aside before it is removed, so the folder is never seen
+# partially removed and the old one is kept if the new one can not be moved
+def replace_folder(tmp_folder, folder):
+    old_folder = f"{folder}.{os.getpid()}.old"
+    if os.path.isdir(folder):
+        os.rename(folder, old_folder)
+    try:
+        os.rename(tmp_folder, folder)
+    except OSError:
+        if os.path.isdir(old_folder):
+            os.rename(old_folder, folder)
+        raise
+    if os.path.islink(old_folder):
+        os.remove(old_folder)
+    else:
+        shutil.rmtree(old_folder, ignore_errors=True)
+
+# Method to find cache entry of dataset file, entries are keyed by file path
+def cache_entry(cache_dir, filename):
+    key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+    return os.path.join(cache_dir, key)
+
+# Method to load cleaned dataset from cache, None is returned if cache is not valid
+def load_cached_dataset(cache_dir, filename):
+    entry = cache_entry(cache_dir, filename)
+    meta_filename = os.path.join(entry, "meta.json")
+    try:
+        with open(meta_filename) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    
+    # Entries of older versions of the tool have other layout or dtype
+    if meta.get("schema") != cache_schema():
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+    
+    stat = os.stat(filename)
+    if meta["size"] != stat.st_size:
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+    if meta["mtime"] != stat.st_mtime_ns:
+        # File was modified, cache is still valid if content is the same
+        if meta["hash"] != hash_file(filename):
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        meta["mtime"] = stat.st_mtime_ns
+        with open(meta_filename, 'w') as f:
+            json.dump(meta, f)
+    
+    # Arrays are memory-mapped, not copied into memory
+    try:
+        X = np.load(os.path.join(entry, "X.npy"), mmap_mode='r')
+        y = np.load(os.path.join(entry, "y.npy"), mmap_mode='r')
+    except FileNotFoundError:
+        # Entry was replaced by other process meanwhile
+        return None
+    
+    # Mark entry as recently used for eviction
+    os.utime(meta_filename)
+    
+    return X, y, meta["imputer"]
+
+# Method to save cleaned dataset into cache
+def save_cached_dataset(cache_dir, filename, X, y, imputer, cache_size=CACHE_SIZE):
+    stat = os.stat(filename)
+    meta = {"path": os.path.abspath(filename), "size": stat.st_size, 
+            "mtime": stat.st_mtime_ns, "hash": hash_file(filename),
+            "schema": cache_schema(),
+            "imputer": {"columns": imputer["columns"], 
+                        "average": float(imputer["average"]), 
+                        "max": float(imputer["max"])}}
+    
+    # Entry is written into temporary folder first, so other processes
+    # never load partially written entry
+    entry = cache_entry(cache_dir, filename)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_entry = f"{entry}.{os.getpid()}.tmp"
+    os.makedirs(tmp_entry, exist_ok=True)
+    np.save(os.path.join(tmp_entry, "X.npy"), np.asarray(X, dtype=np.float32))
+    np.save(os.path.join(tmp_entry, "y.npy"), y)
+    with open(os.path.join(tmp_entry, "meta.json"), 'w') as f:
+        json.dump(meta, f)
+    
+    try:
+        replace_folder(tmp_entry, entry)
+    except OSError:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+    
+    evict_cache(cache_dir, cache_size)
+
+# Method to remove least recently used entries until cache fits into size limit
+def evict_cache(cache_dir, cache_size=CACHE_SIZE):
+    entries = []
+    for name in os.listdir(cache_dir):
+        # Entries which are just written or replaced by other processes are skipped
+        if name.endswith(".tmp") or name.endswith(".old"):
+            continue
+        entry = os.path.join(cache_dir, name)
+        meta_filename = os.path.join(entry, "meta.json")
+        try:
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((os.path.getmtime(meta_filename), size, entry))
+        except (FileNotFoundError, NotADirectoryError):
+            # Entry was removed or replaced by other process meanwhile
+            continue
+    
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total_size <= cache_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total_size = total_size - size
+
+# Method for creating schema of columns parsed from the dataset
+def dataset_schema(filename, keep_columns=None, label=False):
+    # keep_columns - columns of the dataset kept for output, None keeps
+    # whole dataset with column types inferred by pandas
+    names = pd.read_csv(filename, nrows=0).columns
+    features = [names[column] for column in FEATURE_COLUMNS]
+    label_name = names[-1] if label else None
+    
+    if keep_columns is None:
+        return {"features": features, "label": label_name, "keep": None, 
+                "usecols": None, "dtype": None}
+    
+    # Only needed columns are parsed, features directly as float32
+    keep = [names[column] for column in keep_columns]
+    dtype = {name: np.float32 for name in features}
+    dtype.update({name: str for name in keep})
+    if label:
+        dtype[label_name] = str
+    usecols = [name for name in names if name in dtype]
+    
+    return {"features": features, "label": label_name, "keep": keep, 
+            "usecols": usecols, "dtype": dtype}
+
+# Method for loading dataset into matrix of independant variables
+def features_matrix(dataset, schema):
+    return np.ascontiguousarray(dataset[schema["features"]].to_numpy(dtype=np.float32))
+
+# Method for loading dataset labels into vector of dependant variable
+def labels_vector(dataset, schema):
+    return (dataset[schema["label"]].values != "BENIGN").astype(np.uint8)
+
+# Method for selecting part of the dataset kept for output
+def kept_dataset(dataset, schema):
+    if schema["keep"] is None:
+        return dataset
+    return dataset[schema["keep"]]
+
+# Method for scanning dataset by chunks before it is imported by chunks
+def scan_dataset_by_chunks(filename, chunksize, schema, columns=IMPUTED_COLUMNS):
+    dtypes = None
+    statistics = []
+    
+    for chunk in profiler.iterate("scan_csv", pd.read_csv(filename, chunksize=chunksize, usecols=schema["usecols"], dtype=schema["dtype"])):
+        # Column types of the whole dataset, e.g. integer column becomes
+        # float column if any of the chunks contains float values
+        if dtypes is None:
+            dtypes = dict(chunk.dtypes)
+        else:
+            dtypes = {column: np.result_type(dtypes[column], dtype) for column, dtype in chunk.dtypes.items()}
+        
+        # Imputation statistics of the whole dataset
+        statistics.append(imputer_statistics(chunk[schema["features"]].values, columns))
+    
+    return dtypes, merge_imputer(statistics, columns)
+
+# Method for importing unlabelled dataset by chunks of fixed number of rows
+def iterate_unlabelled_dataset(filename, chunksize, imputer=None, keep_columns=None):
+    schema = dataset_schema(filename, keep_columns)
+    dtypes = schema["dtype"]
+    
+    # Whole dataset is parsed with column types of the whole dataset, so
+    # chunks are same as if the dataset was imported at once
+    if dtypes is None or imputer is None:
+        scanned_dtypes, dataset_imputer = scan_dataset_by_chunks(filename, chunksize, schema)
+        if dtypes is None:
+            dtypes = scanned_dtypes
+        if imputer is None:
+            imputer = dataset_imputer
+    
+    for dataset in profiler.iterate("read_csv", pd.read_csv(filename, chunksize=chunksize, usecols=schema["usecols"], dtype=dtypes)):
+        with profiler.stage("imputation", len(dataset)):
+            X_test = features_matrix(dataset, schema)
+            X_test = apply_imputer(X_test, imputer)
+        
+        yield {"dataset": kept_dataset(dataset, schema), "X_test": X_test, "imputer": imputer}
+
+# Method for importing labelled dataset by chunks of fixed number of rows,
+# only features and labels are parsed
+def iterate_dataset(filename, chunksize, imputer=None):
+    schema = dataset_schema(filename, [], label=True)
+    if imputer is None:
+        _, imputer = scan_dataset_by_chunks(filename, chunksize, schema)
+
+    for dataset in profiler.iterate("read_csv", pd.read_csv(filename, chunksize=chunksize, usecols=schema["usecols"], dtype=schema["dtype"])):
+        with profiler.stage("imputation", len(dataset)):
+            X_train = features_matrix(dataset, schema)
+            X_train = apply_imputer(X_train, imputer)
+            y_train = labels_vector(dataset, schema)
+
+        yield {"X_train": X_train, "y_train": y_train, "imputer": imputer}
+
+# Method for importing unlabelled dataset
+def import_unlabelled_dataset(filename, imputer=None, keep_columns=None):
     # Load the dataset
-    dataset = pd.read_csv(filename)
+    schema = dataset_schema(filename, keep_columns)
+    with profiler.stage("read_csv") as record:
+        dataset = pd.read_csv(filename, usecols=schema["usecols"], dtype=schema["dtype"])
+        record["rows"] = len(dataset)
     
-    # Splitting the dataset into independent and dependent variables
-    X = dataset.iloc[:, list(range(4, 6)) + list(range(7, 84))].values
-    y = np.array([0 if val == "BENIGN" else 1 for val in dataset.iloc[:, -1].values])
+    with profiler.stage("imputation", len(dataset)):
+        # Load dataset into matrix of independant variables 
+        X_test = features_matrix(dataset, schema)
+
+        # Taking care of missing and incorrect data, statistics saved with
+        # the classifier are reused when available
+        if imputer is None:
+            imputer = fit_imputer(X_test)
+        X_test = apply_imputer(X_test, imputer)
     
-    # Taking care of missing and incorrect data
-    SUM = 0
-    MAX = 0
-    COUNT = 0
+    return {"dataset": kept_dataset(dataset, schema), "X_test": X_test, "imputer": imputer}
+
+# Method for importing labelled dataset
+def import_dataset(filename, split, cache_dir=None, cache_size=CACHE_SIZE, keep_dataset=True):
+    # Cleaned dataset is loaded from cache if whole dataset is not needed
+    cached = None
+    if cache_dir is not None and not keep_dataset:
+        with profiler.stage("load_cache"):
+            cached = load_cached_dataset(cache_dir, filename)
     
-    # Count average values in columns 15 and 16
-    for i, row in enumerate(X):
-        for j in [15, 16]:
-            sx = str(float(X[i,j])).lower()
-            if  (sx != "nan" and sx != "inf"):
-                SUM = SUM + X[i,j]
-                if X[i,j] > MAX:
-                    MAX = X[i,j]
-                COUNT = COUNT + 1
-    
-    AVERAGE = SUM/COUNT
-    
-    for i, row in enumerate(X):
-        for j in [15, 16]:
-            sx = str(float(X[i,j])).lower()
-            if  sx == "nan":
-                X[i, j] = AVERAGE    
-            if  sx == "inf":
-                X[i, j] = MAX
+    if cached is not None:
+        dataset = None
+        X, y, imputer = cached
+    else:
+        # Load the dataset, only features and labels if whole dataset is not needed
+        schema = dataset_schema(filename, None if keep_dataset else [], label=True)
+        with profiler.stage("read_csv") as record:
+            dataset = pd.read_csv(filename, usecols=schema["usecols"], dtype=schema["dtype"])
+            record["rows"] = len(dataset)
+        
+        with profiler.stage("imputation", len(dataset)):
+            # Splitting the dataset into independent and dependent variables
+            X = features_matrix(dataset, schema)
+            y = labels_vector(dataset, schema)
+            
+            # Taking care of missing and incorrect data
+            imputer = fit_imputer(X)
+            X = apply_imputer(X, imputer)
+        
+        if cache_dir is not None:
+            with profiler.stage("save_cache", len(X)):
+                save_cached_dataset(cache_dir, filename, X, y, imputer, cache_size)
+        if not keep_dataset:
+            dataset = None
     
     # Splitting the dataset into the Training set and Test set   
     if split:
@@ -92,5 +429,124 @@ def import_dataset(filename, split):
     return {"dataset": dataset, 
             "X": X, "y": y, 
             "X_train": X_train, "X_test": X_test,
-            "y_train": y_train, "y_test": y_test
-            }
\ No newline at end of file
+            "y_train": y_train, "y_test": y_test,
+            "imputer": imputer
+            }
+
+# Method for finding dataset files of the sources, source can be file,
+# folder with .csv files or glob pattern
+def expand_sources(sources):
+    filenames = []
+    for source in sources:
+        if os.path.isdir(source):
+            filenames.extend(sorted(glob.glob(os.path.join(source, "*.csv"))))
+        elif glob.has_magic(source):
+            filenames.extend(sorted(glob.glob(source)))
+        else:
+            filenames.append(source)
+    
+    return filenames
+
+# Method for parsing one dataset file, missing and incorrect data are not
+# replaced yet, so imputation statistics of all files can be merged first
+def read_dataset_file(filename, keep_columns=None, label=False):
+    schema = dataset_schema(filename, keep_columns, label)
+    dataset = pd.read_csv(filename, usecols=schema["usecols"], dtype=schema["dtype"])
+    X = features_matrix(dataset, schema)
+    
+    return {"filename": filename,
+            "dataset": kept_dataset(dataset, schema),
+            "X": X,
+            "y": labels_vector(dataset, schema) if label else None,
+            "statistics": imputer_statistics(X)
+            }
+
+# Method for parsing dataset files in parallel worker processes, parsed
+# files are yielded in order of the filenames as soon as they are ready
+def iterate_dataset_files(filenames, jobs=None, keep_columns=None, label=False):
+    jobs = min(jobs or os.cpu_count(), len(filenames))
+    if jobs <= 1:
+        for filename in filenames:
+            yield read_dataset_file(filename, keep_columns, label)
+        return
+    
+    with multiprocessing.Pool(processes=jobs) as pool:
+        yield from pool.imap(partial(read_dataset_file, keep_columns=keep_columns, label=label), filenames)
+
+# Method for importing labelled dataset from more files parsed in parallel,
+# imputation statistics are merged over all files
+def import_dataset_files(filenames, split, jobs=None, keep_dataset=True):
+    with profiler.stage("read_csv") as record:
+        files = list(iterate_dataset_files(filenames, jobs, None if keep_dataset else [], label=True))
+        record["rows"] = sum(len(file["X"]) for file in files)
+    imputer = merge_imputer([file["statistics"] for file in files])
+    
+    with profiler.stage("imputation", sum(len(file["X"]) for file in files)):
+        X = apply_imputer(np.concatenate([file["X"] for file in files]), imputer)
+        y = np.concatenate([file["y"] for file in files])
+    dataset = pd.concat([file["dataset"] for file in files], ignore_index=True) if keep_dataset else None
+    
+    # Splitting the dataset into the Training set and Test set   
+    if split:
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = 0.2, random_state = 0)
+    else:
+        X_train = X
+        X_test = X
+        y_train = y
+        y_test = y
+
+    return {"dataset": dataset, 
+            "X": X, "y": y, 
+            "X_train": X_train, "X_test": X_test,
+            "y_train": y_train, "y_test": y_test,
+            "imputer": imputer
+            }
+
+# Method for importing unlabelled dataset from more files parsed in parallel
+def import_unlabelled_dataset_files(filenames, imputer=None, jobs=None):
+    with profiler.stage("read_csv") as record:
+        files = list(iterate_dataset_files(filenames, jobs, keep_columns=[]))
+        record["rows"] = sum(len(file["X"]) for file in files)
+    if imputer is None:
+        imputer = merge_imputer([file["statistics"] for file in files])
+    
+    with profiler.stage("imputation", record.get("rows")):
+        X_test = apply_imputer(np.concatenate([file["X"] for file in files]), imputer)
+    
+    return {"dataset": None, "X_test": X_test, "imputer": imputer}
+
+# Method for importing labelled dataset files by chunks for training which
+# passes the training set more times, cleaned chunks are saved into the folder
+# as .npy files, so following passes read them without parsing the dataset,
+# every n-th row is held out in memory as validation set
+def spill_dataset_files(filenames, chunksize, folder, validation_split):
+    # Imputation statistics of all files
+    statistics = []
+    for filename in filenames:
+        schema = dataset_schema(filename, [], label=True)
+        for chunk in profiler.iterate("scan_csv", pd.read_csv(filename, chunksize=chunksize, usecols=schema["usecols"], dtype=schema["dtype"])):
+            statistics.append(imputer_statistics(chunk[schema["features"]].values))
+    imputer = merge_imputer(statistics)
+    
+    every = max(int(round(1 / validation_split)), 2)
+    chunks = []
+    X_val = []
+    y_val = []
+    row = 0
+    for filename in filenames:
+        for data in iterate_dataset(filename, chunksize, imputer):
+            validation = (np.arange(row, row + len(data["X_train"])) % every) == 0
+            row = row + len(validation)
+            X_val.append(data["X_train"][validation])
+            y_val.append(data["y_train"][validation])
+            
+            chunk = os.path.join(folder, f"chunk{len(chunks)}")
+            np.save(f"{chunk}_X.npy", data["X_train"][~validation])
+            np.save(f"{chunk}_y.npy", data["y_train"][~validation])
+            chunks.append((f"{chunk}_X.npy", f"{chunk}_y.npy"))
+    
+    X_val = np.concatenate(X_val)
+    y_val = np.concatenate(y_val)
+    
+    return {"chunks": chunks, "samples": row - len(X_val),
+            "X_val": X_val, "y_val": y_val, "imputer": imputer}
@@ -0,0 +1,136 @@
+"""
+FLOW FOLLOWER
+System Log Analysis for Anomaly Detection Using Machine Learning
+MIT License
+Copyright (c) 2020 Miroslav Siklosi
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import io
+import json
+import os
+import time
+from collections import deque
+import numpy as np
+import pandas as pd
+from data_preprocessing import FEATURE_COLUMNS, expand_sources
+
+class FlowFollower:
+    # Follows dataset files which are still written (e.g. by CICFlowMeter),
+    # only complete lines appended since the last poll are parsed, offsets
+    # of labelled lines are saved so following run does not label them again
+
+    def __init__(self, sources, offsets_filename, keep_columns=None, batch_size=1000, max_bytes=64 * 1024**2):
+        self.sources = sources
+        self.offsets_filename = offsets_filename
+        self.keep_columns = keep_columns
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.headers = {}
+        try:
+            with open(offsets_filename) as f:
+                self.offsets = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.offsets = {}
+
+    # Method to read header line of the file, None if it is not complete yet
+    def read_header(self, key, f):
+        if key not in self.headers:
+            f.seek(0)
+            header = f.readline()
+            if not header.endswith(b"\n"):
+                return None
+            self.headers[key] = header
+        return self.headers[key]
+
+    # Method to parse lines of the file, all values are kept as they were
+    # written, so labelled lines are same as lines of the source
+    def parse_lines(self, header, lines):
+        dataset = pd.read_csv(io.BytesIO(header + b"".join(lines)), dtype=str, keep_default_na=False)
+        X_test = dataset.iloc[:, FEATURE_COLUMNS].replace("", "nan").to_numpy().astype(np.float32)
+        if self.keep_columns is not None:
+            dataset = dataset.iloc[:, self.keep_columns]
+
+        return dataset, np.ascontiguousarray(X_test)
+
+    # Method to read batches of new complete lines of all followed files
+    def poll(self):
+        batches = []
+        for filename in expand_sources(self.sources):
+            if not os.path.isfile(filename):
+                continue
+            key = os.path.abspath(filename)
+            stat = os.stat(filename)
+            state = self.offsets.get(key)
+            # New, rotated or truncated file is followed from its beginning
+            if state is None or state["inode"] != stat.st_ino or stat.st_size < state["offset"]:
+                state = {"inode": stat.st_ino, "offset": 0}
+                self.offsets[key] = state
+                self.headers.pop(key, None)
+            if stat.st_size == state["offset"]:
+                continue
+
+            with open(filename, 'rb') as f:
+                header = self.read_header(key, f)
+                if header is None:
+                    continue
+                offset = max(state["offset"], len(header))
+                f.seek(offset)
+                data = f.read(self.max_bytes)
+            arrived = time.time()
+
+            # Incomplete last line is left for the next poll
+            end = data.rfind(b"\n") + 1
+            lines = data[:end].splitlines(keepends=True)
+
+            start = 0
+            while start < len(lines):
+                batch_lines = lines[start:start + self.batch_size]
+                start = start + len(batch_lines)
+                batch_end = offset + sum(len(line) for line in batch_lines)
+                batch_lines = [line for line in batch_lines if line.strip()]
+                if batch_lines:
+                    dataset, X_test = self.parse_lines(header, batch_lines)
+                    batches.append({"filename": filename, "key": key, "inode": stat.st_ino,
+                                    "offset": batch_end, "dataset": dataset, "X_test": X_test,
+                                    # Lines were appended at latest when the file was modified
+                                    "appended": stat.st_mtime, "arrived": arrived})
+                offset = batch_end
+        return batches
+
+    # Method to save offset of labelled batch, the file is replaced at once,
+    # so offsets are never lost by interrupted saving
+    def commit(self, batch):
+        self.offsets[batch["key"]] = {"inode": batch["inode"], "offset": batch["offset"]}
+        tmp_filename = f"{self.offsets_filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.offsets, f, indent=4)
+        os.replace(tmp_filename, self.offsets_filename)
+
+class LatencyStats:
+    # Latency of labelled flows from the moment they were appended to the
+    # followed file until their labels were written
+
+    def __init__(self, maxlen=10000):
+        self.started = time.time()
+        self.batches = deque(maxlen=maxlen)
+        self.rows = 0
+
+    def add(self, batch, written):
+        self.batches.append((written - batch["appended"], written - batch["arrived"], len(batch["X_test"])))
+        self.rows = self.rows + len(batch["X_test"])
+
+    def summary(self):
+        if not self.batches:
+            return {"rows": self.rows, "rows_per_s": 0.0}
+        latencies, processing, counts = (np.array(values) for values in zip(*self.batches))
+        latencies = np.repeat(latencies, counts) * 1000
+        processing = np.repeat(processing, counts) * 1000
+        return {"rows": self.rows,
+                "rows_per_s": self.rows / (time.time() - self.started),
+                "latency_ms_p50": float(np.percentile(latencies, 50)),
+                "latency_ms_p95": float(np.percentile(latencies, 95)),
+                "latency_ms_p99": float(np.percentile(latencies, 99)),
+                "processing_ms_p50": float(np.percentile(processing, 50)),
+                "processing_ms_p99": float(np.percentile(processing, 99))}
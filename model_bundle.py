@@ -0,0 +1,266 @@
+"""
+MODEL BUNDLE
+System Log Analysis for Anomaly Detection Using Machine Learning
+MIT License
+Copyright (c) 2020 Miroslav Siklosi
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import glob
+import json
+import os
+import platform
+import shutil
+import time
+from importlib import metadata
+import numpy as np
+from joblib import dump, load
+from data_preprocessing import FEATURE_COLUMNS, hash_file, replace_folder
+from numpy_inference import exportable, export_network, export_forest, save_engine_arrays, load_engine
+
+# Version of the bundle layout, bundles of newer layout are not loaded
+BUNDLE_FORMAT = 1
+
+# Files of the bundle
+MANIFEST = "manifest.json"
+ENGINE = "engine"
+
+# ML models of trees, scikit-learn copies nodes of the trees when they are
+# loaded, so memory-mapping only slows loading down, trees are memory-mapped
+# by NumPy engine instead
+TREE_MODELS = ("DTC", "RFC", "iF")
+
+# ML models whose prediction needs writable arrays, e.g. cluster centers of
+# K-Means and Mini-Batch K-Means are passed to Cython code as writable buffers
+WRITABLE_MODELS = ("K-Means",)
+
+# ML models loaded without memory-mapping
+UNMAPPED_MODELS = TREE_MODELS + WRITABLE_MODELS
+
+# Bundle of ML model is folder classifiers/<model> with manifest describing it,
+# the folder is symbolic link to the current version classifiers/<model>.v<time>:
+#   format     - version of the bundle layout
+#   model      - flag of ML model
+#   version    - hash of the classifier file, changes with every training
+#   classifier - file of the classifier (.joblib saved uncompressed or .h5)
+#   engine     - folder of arrays exported for NumPy inference (ANN, DTC, RFC)
+#   schema     - names and positions of feature columns of the training dataset
+#   imputer    - imputation statistics of the training dataset
+#   reduction  - feature reduction fitted on the training dataset (fit_reduction)
+#   training   - size, modification time and hash of the training datasets
+#                (dataset_fingerprint)
+#   metrics    - metrics of the last evaluation of the classifier (mode research)
+#   timing     - duration of training and saving
+#   libraries  - versions of libraries which saved the classifier
+
+# Method to get folder of the bundle of ML model
+def bundle_dir(classifier_dir, model):
+    return os.path.join(classifier_dir, model)
+
+# Method to get folder of the current version of the bundle, manifest and
+# classifier read from it belong together even if the bundle is replaced
+def current_bundle(classifier_dir, model):
+    return os.path.realpath(bundle_dir(classifier_dir, model))
+
+# Method to get version of the bundle from its folder, None for other folders
+def bundle_version(version_folder):
+    _, _, version = version_folder.rpartition(".v")
+    return int(version) if version.isdigit() else None
+
+# Method to remove old versions of the bundle, the previous version is kept
+# for processes which are just loading it and newer versions are still saved
+def remove_old_versions(folder):
+    current = bundle_version(os.path.realpath(folder))
+    if current is None:
+        return
+    versions = (bundle_version(version_folder) for version_folder in glob.glob(f"{glob.escape(folder)}.v*"))
+    older = sorted(version for version in versions if version is not None and version < current)
+    for version in older[:-1]:
+        shutil.rmtree(f"{folder}.v{version}", ignore_errors=True)
+
+# Method to make saved version of the bundle current by replacing symbolic
+# link of the bundle at once, so other processes always find complete bundle
+def link_bundle(version_folder, folder):
+    link = f"{folder}.{os.getpid()}.link"
+    try:
+        os.symlink(os.path.basename(version_folder), link)
+    except (OSError, NotImplementedError):
+        # Symbolic links are not permitted (e.g. on Windows), previous
+        # bundle is renamed aside instead
+        replace_folder(version_folder, folder)
+        return
+    if os.path.isdir(folder) and not os.path.islink(folder):
+        # Bundle saved by older version of the tool is folder
+        old_folder = f"{folder}.{os.getpid()}.old"
+        os.rename(folder, old_folder)
+        os.replace(link, folder)
+        shutil.rmtree(old_folder, ignore_errors=True)
+    else:
+        os.replace(link, folder)
+    remove_old_versions(folder)
+
+# Method to check if bundle of ML model was saved
+def has_bundle(classifier_dir, model):
+    return os.path.isfile(os.path.join(bundle_dir(classifier_dir, model), MANIFEST))
+
+# Method to get versions of libraries saving the classifier, libraries are
+# not imported
+def library_versions(deep_learning=False):
+    versions = {"python": platform.python_version(), "numpy": np.__version__, "scikit-learn": metadata.version("scikit-learn")}
+    if deep_learning:
+        versions["keras"] = metadata.version("keras")
+    return versions
+
+# Method to get fingerprint of training datasets
+def dataset_fingerprint(sources):
+    fingerprint = []
+    for source in sources:
+        stat = os.stat(source)
+        fingerprint.append({"path": os.path.abspath(source), "size": stat.st_size,
+                            "mtime": stat.st_mtime_ns, "sha1": hash_file(source)})
+    return fingerprint
+
+# Method to save bundle of ML model, the bundle is written into folder of
+# new version first, so other processes never load partially written bundle.
+# Processes which already mapped the replaced bundle keep using it
+def save_bundle(classifier_dir, model, classifier, deep_learning=False, imputer=None,
+                features=None, training=(), timing=None, reduction=None):
+    folder = bundle_dir(classifier_dir, model)
+    version_folder = f"{folder}.v{time.time_ns()}"
+    os.makedirs(version_folder)
+
+    started = time.perf_counter()
+    if deep_learning:
+        classifier_file = "classifier.h5"
+        classifier.save(os.path.join(version_folder, classifier_file))
+    else:
+        # Uncompressed, so arrays of the classifier can be memory-mapped
+        classifier_file = "classifier.joblib"
+        dump(classifier, os.path.join(version_folder, classifier_file))
+
+    # Arrays for NumPy inference are exported together with the classifier
+    engine = None
+    if model in exportable:
+        try:
+            exported = export_network(classifier) if deep_learning else export_forest(classifier)
+            save_engine_arrays(exported, os.path.join(version_folder, ENGINE))
+            engine = ENGINE
+        except (ValueError, AttributeError) as e:
+            # e.g. layers which can not be exported or forest without trees
+            print(f"Classifier was not exported for NumPy inference: {e}")
+
+    timing = dict(timing or {}, save_s=time.perf_counter() - started)
+    manifest = {"format": BUNDLE_FORMAT,
+                "model": model,
+                "version": hash_file(os.path.join(version_folder, classifier_file)),
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "classifier": classifier_file,
+                "engine": engine,
+                "schema": {"features": list(features) if features is not None else None,
+                           "feature_columns": FEATURE_COLUMNS},
+                "imputer": None if imputer is None else {"columns": list(imputer["columns"]),
+                                                         "average": float(imputer["average"]),
+                                                         "max": float(imputer["max"])},
+                "reduction": reduction,
+                "training": list(training),
+                "metrics": None,
+                "timing": timing,
+                "libraries": library_versions(deep_learning)}
+    with open(os.path.join(version_folder, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+    link_bundle(version_folder, folder)
+    return folder
+
+# Method to load manifest of the bundle
+def load_manifest(folder):
+    with open(os.path.join(folder, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest["format"] > BUNDLE_FORMAT:
+        raise ValueError(f"Bundle {folder} has newer format {manifest['format']}, update the tool to load it")
+    return manifest
+
+# Method to update manifest of the bundle, the file is replaced at once
+def update_manifest(folder, **fields):
+    manifest = load_manifest(folder)
+    manifest.update(fields)
+    tmp_filename = os.path.join(folder, f"{MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp_filename, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_filename, os.path.join(folder, MANIFEST))
+    return manifest
+
+# Method to load classifier of the bundle, arrays are memory-mapped read-only
+# unless the classifier is going to be trained further
+def load_bundle_classifier(folder, manifest, engine="native", mmap=True):
+    if engine == "numpy":
+        if manifest["engine"] is None:
+            raise ValueError(f"Bundle {folder} does not contain classifier exported for NumPy inference")
+        return load_engine(os.path.join(folder, manifest["engine"]))
+
+    filename = os.path.join(folder, manifest["classifier"])
+    if filename.endswith(".h5"):
+        # Keras is imported only when neural network is loaded
+        from keras.models import load_model
+        return load_model(filename)
+    return load(filename, mmap_mode='r' if mmap and manifest["model"] not in UNMAPPED_MODELS else None)
+
+# Method to find saved classifier of ML model, current version of the bundle
+# is preferred to classifier files saved by older versions, None if the model
+# was not trained
+def find_classifier(classifier_dir, model, engine="native"):
+    if has_bundle(classifier_dir, model):
+        return current_bundle(classifier_dir, model)
+    # Classifier exported into arrays by numpy_inference.py
+    extensions = (".npz",) if engine == "numpy" else (".joblib", ".h5")
+    for extension in extensions:
+        filename = os.path.join(classifier_dir, f"classifier_{model}{extension}")
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+# Method to load classifier found by find_classifier, manifest is None for
+# classifier files saved by older versions
+def load_saved_classifier(filename, manifest=None, engine="native", mmap=True):
+    if manifest is not None:
+        return load_bundle_classifier(filename, manifest, engine, mmap)
+    if filename.endswith(".npz"):
+        return load_engine(filename)
+    if filename.endswith(".h5"):
+        # Keras is imported only when neural network is loaded
+        from keras.models import load_model
+        return load_model(filename)
+    return load(filename)
+
+# Method to load saved ML model, manifest, imputation statistics, feature
+# reduction and classifier are read from the same version of the bundle even
+# if the model is retrained meanwhile. Classifier is loaded only if requested,
+# it is None (as filename) if the model was not trained
+def load_model_bundle(classifier_dir, model, engine="native", mmap=True, classifier=True):
+    filename = find_classifier(classifier_dir, model, engine)
+    bundle = {"filename": filename, "manifest": None, "classifier": None, "imputer": None, "reduction": None}
+    if filename is not None and os.path.isdir(filename):
+        manifest = load_manifest(filename)
+        bundle.update(manifest=manifest, imputer=manifest["imputer"], reduction=manifest.get("reduction"))
+    else:
+        # Imputation statistics saved next to classifier by older versions
+        imputer_filename = os.path.join(classifier_dir, f"imputer_{model}.joblib")
+        if os.path.isfile(imputer_filename):
+            bundle["imputer"] = load(imputer_filename)
+    if classifier and filename is not None:
+        bundle["classifier"] = load_saved_classifier(filename, bundle["manifest"], engine, mmap)
+    return bundle
+
+# Method to find differences between dataset and schema of the bundle
+def schema_differences(manifest, features):
+    expected = manifest["schema"]["features"]
+    if expected is None:
+        return []
+    return [f"{position}: {name!r} instead of {got!r}" for position, (name, got) in enumerate(zip(expected, features)) if name != got]
+
+# Method to find libraries with different version than the classifier was saved by
+def library_differences(manifest):
+    current = library_versions("keras" in manifest["libraries"])
+    return [f"{library} {version} (saved by {manifest['libraries'][library]})" for library, version in current.items()
+            if manifest["libraries"].get(library) not in (None, version)]
@@ -0,0 +1,139 @@
+"""
+MODEL COMPARISON
+System Log Analysis for Anomaly Detection Using Machine Learning
+MIT License
+Copyright (c) 2020 Miroslav Siklosi
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+import ML_modules as ML
+from data_preprocessing import import_dataset, CACHE_SIZE, REDUCTION_METHODS, fit_reduction, apply_reduction
+from data_output import compute_metrics
+
+# Arrays of the dataset shared with worker processes
+shared_arrays = ("X", "y", "X_train", "X_test", "y_train", "y_test")
+
+# Method to save arrays of imported dataset, so worker processes can
+# memory-map them instead of receiving their pickled copies
+def share_dataset(data, shared_dir):
+    for name in shared_arrays:
+        np.save(os.path.join(shared_dir, f"{name}.npy"), data[name])
+
+# Method to load arrays of imported dataset memory-mapped
+def load_shared_dataset(shared_dir):
+    return {name: np.load(os.path.join(shared_dir, f"{name}.npy"), mmap_mode='r') for name in shared_arrays}
+
+# Method to train and evaluate one ML model in worker process, same way as
+# command trainandpredict in mode research
+def evaluate_model(model, shared_dir):
+    data = load_shared_dataset(shared_dir)
+
+    if model in ML.unsupervised:
+        # Unsupervised models are fitted and predict whole dataset at once
+        start = time.perf_counter()
+        y_pred = ML.unsupervised_labels(ML.models[model]({"X_test": data["X"]}))
+        fit_time = time.perf_counter() - start
+        predict_time = None
+        y_test = data["y"]
+    else:
+        start = time.perf_counter()
+        classifier = ML.models[model](data)
+        fit_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        y_pred = ML.predict_classifier(classifier, model, data["X_test"])
+        predict_time = time.perf_counter() - start
+        y_test = data["y_test"]
+
+    metrics = compute_metrics(y_test, y_pred)
+    return {"model": model,
+            "accuracy": float(metrics["accuracy"]),
+            "precision": float(metrics["precision"]),
+            "recall": float(metrics["recall"]),
+            "f1": float(metrics["f1"]),
+            "fit_s": fit_time,
+            "predict_s": predict_time,
+            # Peak resident memory of the worker process, in kilobytes on Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+# Method to evaluate ML models concurrently, every model in new process
+# so its peak memory is measured separately. Processes are spawned, not
+# forked, so peak memory does not include the dataset imported by parent
+def compare_models(model_list, data, jobs, tmp_dir=None):
+    shared_dir = tempfile.mkdtemp(prefix="traffic_analysis_", dir=tmp_dir)
+    try:
+        share_dataset(data, shared_dir)
+        with multiprocessing.get_context("spawn").Pool(processes=jobs, maxtasksperchild=1) as pool:
+            results = pool.starmap(evaluate_model, [(model, shared_dir) for model in model_list], chunksize=1)
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+    return pd.DataFrame(results).set_index("model")
+
+# Method to reduce features of imported dataset by reduction fitted on its
+# training set, same reduction is applied for all models
+def reduce_dataset(data, methods):
+    reduction = fit_reduction(data["X_train"], data["y_train"], methods)
+    reduced = dict(data)
+    for name in ("X", "X_train", "X_test"):
+        reduced[name] = apply_reduction(data[name], reduction)
+    return reduced
+
+# Method to join comparisons of full and reduced features with speedup of
+# fitting and predicting together and change of accuracy
+def compare_reduction(comparison, reduced):
+    joined = comparison.join(reduced, rsuffix="_reduced")
+    joined["speedup"] = ((joined["fit_s"] + joined["predict_s"].fillna(0))
+                         / (joined["fit_s_reduced"] + joined["predict_s_reduced"].fillna(0)))
+    joined["accuracy_change"] = joined["accuracy_reduced"] - joined["accuracy"]
+    return joined
+
+if __name__ == "__main__":
+    # Create parser
+    parser = argparse.ArgumentParser(prog="model_comparison.py")
+    parser.add_argument("--models", dest="models", nargs="+", default=["all"])
+    parser.add_argument("--source", dest="source", required=True)
+    parser.add_argument("--jobs", dest="jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--output", dest="output", default=None)
+    parser.add_argument("--cache-dir", dest="cache_dir", default=None)
+    parser.add_argument("--tmp-dir", dest="tmp_dir", default=None)
+    parser.add_argument("--feature-reduction", dest="feature_reduction", nargs="+", choices=REDUCTION_METHODS, default=None)
+    args = parser.parse_args()
+
+    model_list = list(ML.models) if args.models == ["all"] else args.models
+    unknown = [model for model in model_list if model not in ML.models]
+    if unknown:
+        print(f"Unknown ML models {', '.join(unknown)}, choose from {', '.join(ML.models)}")
+        sys.exit(1)
+
+    if not args.source.lower().endswith(".csv"):
+        print(f"{args.source} is not dataset with extension .csv")
+        sys.exit(1)
+
+    # Dataset is imported and preprocessed only once for all models
+    data = import_dataset(args.source, split=True, cache_dir=args.cache_dir, cache_size=CACHE_SIZE, keep_dataset=False)
+    comparison = compare_models(model_list, data, args.jobs, args.tmp_dir)
+    if args.feature_reduction is not None:
+        reduced = reduce_dataset(data, args.feature_reduction)
+        print(f"Feature reduction ({' '.join(args.feature_reduction)}) kept {reduced['X'].shape[1]} of {data['X'].shape[1]} features")
+        comparison = compare_reduction(comparison, compare_models(model_list, reduced, args.jobs, args.tmp_dir))
+
+    pd.set_option("display.width", 200)
+    print(comparison.to_string(float_format=lambda x: f"{x:.4f}", na_rep="-"))
+    if args.output is not None:
+        if args.output.lower().endswith(".json"):
+            comparison.reset_index().to_json(args.output, orient="records", indent=4)
+        else:
+            comparison.to_csv(args.output)
+        print(f"Comparison saved into {args.output}")
@@ -0,0 +1,302 @@
+"""
+NUMPY INFERENCE
+System Log Analysis for Anomaly Detection Using Machine Learning
+MIT License
+Copyright (c) 2020 Miroslav Siklosi
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+# ML models which can be exported into arrays
+exportable = ("ANN", "DTC", "RFC")
+
+# Number of rows predicted at once, limits memory of intermediate arrays,
+# trees are traversed in smaller batches which fit into CPU cache
+BATCH_SIZE = 65536
+TREE_BATCH_SIZE = 4096
+
+# Index of child node of leaves in sklearn trees
+TREE_LEAF = -1
+
+# Method for softmax activation
+def softmax(x):
+    e = np.exp(x - x.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+# Activation functions of dense layers
+activations = {"linear": lambda x: x,
+               "relu": lambda x: np.maximum(x, 0),
+               # Same as logistic function, but never overflows
+               "sigmoid": lambda x: 0.5 * (1 + np.tanh(0.5 * x)),
+               "tanh": np.tanh,
+               "softmax": softmax}
+
+class NumpyNetwork:
+    # Feed-forward neural network of dense layers, predict returns output
+    # of the last layer same as keras model, features are standardized first
+    # if the network starts by normalization layer
+
+    def __init__(self, weights, biases, activation_names, mean=None, std=None):
+        self.weights = weights
+        self.biases = biases
+        self.activation_names = list(activation_names)
+        self.mean = mean
+        self.std = std
+
+    def predict(self, X, batch_size=BATCH_SIZE):
+        outputs = []
+        for start in range(0, len(X), batch_size):
+            a = np.asarray(X[start:start + batch_size], dtype=np.float32)
+            if self.mean is not None:
+                a = (a - self.mean) / self.std
+            for W, b, name in zip(self.weights, self.biases, self.activation_names):
+                a = activations[name](a @ W + b)
+            outputs.append(a)
+        return np.concatenate(outputs) if outputs else np.empty((0, self.biases[-1].size), dtype=np.float32)
+
+    def arrays(self):
+        arrays = {"kind": np.array("network"), "activations": np.array(self.activation_names)}
+        for i, (W, b) in enumerate(zip(self.weights, self.biases)):
+            arrays[f"W{i}"] = W
+            arrays[f"b{i}"] = b
+        if self.mean is not None:
+            arrays["mean"] = self.mean
+            arrays["std"] = self.std
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        names = [str(name) for name in arrays["activations"]]
+        return cls([arrays[f"W{i}"] for i in range(len(names))], [arrays[f"b{i}"] for i in range(len(names))], names,
+                   arrays.get("mean"), arrays.get("std"))
+
+class NumpyForest:
+    # Decision trees flattened into node tables, all trees are traversed for
+    # the whole batch of rows at once, one level per step. Leaves point to
+    # themselves, so rows which reached a leaf stay in it until the last level
+
+    def __init__(self, classes, roots, children, feature, threshold, value, depth):
+        self.classes = classes
+        self.roots = roots
+        self.children = children
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.depth = int(depth)
+
+    # Method to find leaves of all trees for the rows
+    def apply(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        offsets = (np.arange(len(X), dtype=self.feature.dtype) * X.shape[1])[:, None]
+        X = X.ravel()
+        nodes = np.tile(self.roots, (len(offsets), 1))
+        for level in range(self.depth):
+            go_left = X[offsets + self.feature[nodes]] <= self.threshold[nodes]
+            # Left child is the first, right child the second one
+            nodes = self.children[2 * nodes + ~go_left]
+        return nodes
+
+    def predict_proba(self, X, batch_size=TREE_BATCH_SIZE):
+        probabilities = []
+        for start in range(0, len(X), batch_size):
+            nodes = self.apply(X[start:start + batch_size])
+            # Probabilities of trees are summed in same order as by sklearn
+            proba = np.zeros((len(nodes), len(self.classes)))
+            for tree in range(len(self.roots)):
+                proba += self.value[nodes[:, tree]]
+            probabilities.append(proba / len(self.roots))
+        return np.concatenate(probabilities) if probabilities else np.empty((0, len(self.classes)))
+
+    def predict(self, X):
+        return self.classes[np.argmax(self.predict_proba(X), axis=1)]
+
+    def arrays(self):
+        return {"kind": np.array("forest"), "classes": self.classes, "roots": self.roots,
+                "children": self.children, "feature": self.feature, "threshold": self.threshold,
+                "value": self.value, "depth": np.array(self.depth)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays["classes"], arrays["roots"], arrays["children"], arrays["feature"],
+                   arrays["threshold"], arrays["value"], arrays["depth"])
+
+# Method to export keras network of dense layers, optionally starting by
+# normalization layer
+def export_network(network):
+    from keras import backend
+    
+    weights, biases, activation_names = [], [], []
+    mean, std = None, None
+    for i, layer in enumerate(network.layers):
+        config = layer.get_config()
+        if i == 0 and type(layer).__name__ == "Normalization":
+            # Same standardization as by the layer
+            mean = np.asarray(layer.mean, dtype=np.float32).ravel()
+            std = np.maximum(np.sqrt(np.asarray(layer.variance, dtype=np.float32).ravel()), np.float32(backend.epsilon()))
+            continue
+        if type(layer).__name__ != "Dense" or config["activation"] not in activations:
+            raise ValueError(f"Layer {layer.name} of type {type(layer).__name__} can not be exported")
+        W, b = layer.get_weights()
+        weights.append(W.astype(np.float32))
+        biases.append(b.astype(np.float32))
+        activation_names.append(config["activation"])
+    return NumpyNetwork(weights, biases, activation_names, mean, std)
+
+# Method to export sklearn decision tree or random forest
+def export_forest(classifier):
+    # Forest trained incrementally keeps sklearn forest inside
+    classifier = getattr(classifier, "forest", classifier)
+    trees = getattr(classifier, "estimators_", [classifier])
+
+    roots, children, feature, threshold, value = [], [], [], [], []
+    offset = 0
+    depth = 0
+    for tree in trees:
+        tree = tree.tree_
+        nodes = np.arange(tree.node_count)
+        leaf = tree.children_left == TREE_LEAF
+        roots.append(offset)
+        # Leaves are their own children
+        children.append(np.stack([np.where(leaf, nodes, tree.children_left), 
+                                  np.where(leaf, nodes, tree.children_right)], axis=1).ravel() + offset)
+        feature.append(np.where(leaf, 0, tree.feature))
+        # Thresholds are rounded down to float32, float32 features compare
+        # with them same as with the original float64 thresholds
+        threshold32 = tree.threshold.astype(np.float32)
+        threshold32 = np.where(threshold32.astype(np.float64) > tree.threshold, np.nextafter(threshold32, np.float32(-np.inf)), threshold32)
+        threshold.append(np.where(leaf, np.float32(np.inf), threshold32))
+        # Class probabilities of nodes, normalized same as by sklearn
+        proba = tree.value[:, 0, :]
+        normalizer = proba.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        value.append(proba / normalizer)
+        offset = offset + tree.node_count
+        depth = max(depth, tree.max_depth)
+
+    return NumpyForest(np.asarray(classifier.classes_), np.array(roots, dtype=np.int32),
+                       np.concatenate(children).astype(np.int32), np.concatenate(feature).astype(np.int32),
+                       np.concatenate(threshold).astype(np.float32), np.concatenate(value), depth)
+
+# Method to load saved classifier of ML model by its framework
+def load_framework_classifier(model, filename):
+    if model == "ANN":
+        from keras.models import load_model
+        return load_model(filename)
+    from joblib import load
+    return load(filename)
+
+# Method to export saved classifier of ML model
+def export_classifier(model, filename):
+    classifier = load_framework_classifier(model, filename)
+    return export_network(classifier) if model == "ANN" else export_forest(classifier)
+
+# Method to save exported classifier
+def save_engine(engine, filename):
+    with open(filename, 'wb') as f:
+        np.savez(f, **engine.arrays())
+
+# Method to save exported classifier into folder of model bundle, every
+# array into its own .npy file, so it can be memory-mapped
+def save_engine_arrays(engine, folder):
+    os.makedirs(folder, exist_ok=True)
+    for name, array in engine.arrays().items():
+        np.save(os.path.join(folder, f"{name}.npy"), array)
+
+# Method to load exported classifier, no ML framework is imported, arrays
+# saved in folder are memory-mapped and shared by all processes using them
+def load_engine(filename):
+    if os.path.isdir(filename):
+        arrays = {os.path.splitext(name)[0]: np.load(os.path.join(filename, name), mmap_mode='r').view(np.ndarray)
+                  for name in os.listdir(filename) if name.endswith(".npy")}
+    else:
+        with np.load(filename) as arrays:
+            arrays = {name: arrays[name] for name in arrays.files}
+    if str(arrays["kind"]) == "network":
+        return NumpyNetwork.from_arrays(arrays)
+    return NumpyForest.from_arrays(arrays)
+
+# Method to get filename of classifier saved by the tool and its export
+def classifier_filenames(classifier_dir, model):
+    extension = ".h5" if model == "ANN" else ".joblib"
+    return os.path.join(classifier_dir, f"classifier_{model}{extension}"), os.path.join(classifier_dir, f"classifier_{model}.npz")
+
+# Method to compare predictions of exported classifier with the original
+# framework on the dataset, bundle of the model is used if it was saved
+def check_parity(model, classifier_dir, source):
+    from data_preprocessing import import_unlabelled_dataset, apply_reduction
+    from ML_modules import predict_classifier
+    from model_bundle import load_model_bundle, find_classifier, load_saved_classifier
+
+    bundle = load_model_bundle(classifier_dir, model, classifier=False)
+    manifest = bundle["manifest"]
+    imputer = bundle["imputer"]
+    reduction = bundle["reduction"]
+    # Classifier exported into bundle or into file next to the classifier
+    exported_filename = bundle["filename"] if manifest is not None else find_classifier(classifier_dir, model, "numpy")
+    load_exported = lambda: load_saved_classifier(exported_filename, manifest, "numpy")
+    load_original = lambda: load_saved_classifier(bundle["filename"], manifest)
+    X = import_unlabelled_dataset(source, imputer, keep_columns=[])["X_test"]
+    if reduction is not None:
+        X = apply_reduction(X, reduction)
+
+    start = time.perf_counter()
+    engine = load_exported()
+    engine_load = time.perf_counter() - start
+    start = time.perf_counter()
+    engine_output = engine.predict(X) if model == "ANN" else engine.predict_proba(X)
+    y_engine = predict_classifier(engine, model, X)
+    engine_predict = time.perf_counter() - start
+
+    start = time.perf_counter()
+    classifier = load_original()
+    framework_load = time.perf_counter() - start
+    start = time.perf_counter()
+    if model == "ANN":
+        framework_output = classifier.predict(X, verbose=0)
+    else:
+        framework_output = getattr(classifier, "forest", classifier).predict_proba(X)
+    y_framework = predict_classifier(classifier, model, X)
+    framework_predict = time.perf_counter() - start
+
+    same = int((y_engine == y_framework).sum())
+    print(f"Identical predictions of {model}: {same} of {len(X)} flows")
+    print(f"Maximal difference of outputs: {np.abs(engine_output - framework_output).max() if len(X) else 0.0:.3g}")
+    print(f"Loading: numpy {engine_load:.4f} s, framework {framework_load:.4f} s (including import)")
+    print(f"Prediction: numpy {engine_predict:.4f} s, framework {framework_predict:.4f} s")
+    return same == len(X)
+
+if __name__ == "__main__":
+    # Create parser
+    parser = argparse.ArgumentParser(prog="numpy_inference.py")
+    parser.add_argument("--command", dest="command", choices=["export", "check"], required=True)
+    parser.add_argument("--model", dest="model", choices=exportable, required=True)
+    parser.add_argument("--classifiers", dest="classifier_dir", default="classifiers")
+    parser.add_argument("--source", dest="source", default=None)
+    args = parser.parse_args()
+
+    filename, engine_filename = classifier_filenames(args.classifier_dir, args.model)
+    if args.command == "export": # EXPORT
+        if not os.path.isfile(filename):
+            print(f"{filename} was not found!")
+            sys.exit(1)
+        try:
+            engine = export_classifier(args.model, filename)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        save_engine(engine, engine_filename)
+        print(f"Exported classifier saved into file {engine_filename}")
+
+    else: # CHECK
+        from model_bundle import has_bundle
+        if args.source is None or not (has_bundle(args.classifier_dir, args.model) or os.path.isfile(engine_filename)):
+            print(f"Parity check needs dataset --source and bundle or exported classifier {engine_filename}")
+            sys.exit(1)
+        if not check_parity(args.model, args.classifier_dir, args.source):
+            sys.exit(1)
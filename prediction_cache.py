@@ -0,0 +1,113 @@
+"""
+PREDICTION CACHE
+System Log Analysis for Anomaly Detection Using Machine Learning
+MIT License
+Copyright (c) 2020 Miroslav Siklosi
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import os
+import numpy as np
+import pandas as pd
+from ML_modules import predict_classifier
+from profiling import profiler
+
+# Default number of labels kept in the persistent cache
+CACHE_ENTRIES = 1000000
+
+# Method for hashing rows of cleaned feature matrix into 64-bit keys, same
+# rows have same keys in every run
+def hash_rows(X):
+    return pd.util.hash_pandas_object(pd.DataFrame(X, copy=False), index=False).values
+
+class PredictionCache:
+    # Labels of feature vectors keyed by version of the classifier and hash
+    # of the vector, keys are kept sorted for vectorized lookup. Least
+    # recently used labels are removed when there are more than capacity of
+    # them, so cache of long-running process does not grow. Cache is saved
+    # into .npz file if filename is given. Version of the classifier is hash
+    # of its file (data_preprocessing.hash_file)
+
+    def __init__(self, filename=None, version="", capacity=CACHE_ENTRIES):
+        self.filename = filename
+        self.capacity = capacity
+        # Version is mixed into every key, so one file can keep labels of more classifiers
+        self.version_key = np.uint64(int(version[:16] or "0", 16))
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.labels = np.empty(0, dtype=np.int8)
+        self.used = np.empty(0, dtype=np.int64)
+        if filename is not None and os.path.isfile(filename):
+            with np.load(filename) as arrays:
+                self.keys, self.labels, self.used = arrays["keys"], arrays["labels"], arrays["used"]
+            # Cache may be saved with bigger capacity
+            self.evict()
+        # Time of use counts lookups, continues from the saved cache
+        self.tick = int(self.used.max()) + 1 if self.used.size else 0
+        self.rows = 0
+        self.unique = 0
+        self.hits = 0
+
+    # Method to find labels of the keys, -1 for keys which are not cached
+    def lookup(self, hashes):
+        keys = hashes ^ self.version_key
+        labels = np.full(len(keys), -1, dtype=np.int8)
+        if self.keys.size:
+            positions = np.minimum(np.searchsorted(self.keys, keys), self.keys.size - 1)
+            found = self.keys[positions] == keys
+            labels[found] = self.labels[positions[found]]
+            self.used[positions[found]] = self.tick
+        self.tick = self.tick + 1
+        return labels
+
+    # Method to add predicted labels of the keys
+    def add(self, hashes, labels):
+        keys = hashes ^ self.version_key
+        order = np.argsort(keys)
+        keys = keys[order]
+        positions = np.searchsorted(self.keys, keys)
+        self.keys = np.insert(self.keys, positions, keys)
+        self.labels = np.insert(self.labels, positions, np.asarray(labels, dtype=np.int8)[order])
+        self.used = np.insert(self.used, positions, np.full(len(keys), self.tick, dtype=np.int64))
+        self.evict()
+
+    # Method to remove least recently used labels above capacity
+    def evict(self):
+        if self.keys.size > self.capacity:
+            keep = np.sort(np.argpartition(-self.used, self.capacity - 1)[:self.capacity])
+            self.keys, self.labels, self.used = self.keys[keep], self.labels[keep], self.used[keep]
+
+    # Method to save cache, the file is replaced at once, so other processes
+    # never load partially written cache
+    def save(self):
+        if self.filename is None:
+            return
+        tmp_filename = f"{self.filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, 'wb') as f:
+            np.savez(f, keys=self.keys, labels=self.labels, used=self.used)
+        os.replace(tmp_filename, self.filename)
+
+    # Method to get statistics of deduplication and cache hits
+    def summary(self):
+        return {"rows": self.rows, "unique": self.unique, "hits": self.hits,
+                "predicted": self.unique - self.hits, "entries": int(self.keys.size),
+                "unique_rate": self.unique / self.rows if self.rows else 0.0,
+                "hit_rate": self.hits / self.unique if self.unique else 0.0}
+
+# Method to predict labels of unique feature vectors only, labels are
+# broadcast back to duplicate rows and cached labels are not predicted again
+def predict_unique(classifier, model, X, cache):
+    with profiler.stage("dedup", len(X)):
+        hashes, first, inverse = np.unique(hash_rows(X), return_index=True, return_inverse=True)
+        labels = cache.lookup(hashes)
+        missing = np.flatnonzero(labels < 0)
+
+    if missing.size:
+        y_missing = predict_classifier(classifier, model, X[first[missing]])
+        labels[missing] = y_missing
+        cache.add(hashes[missing], y_missing)
+
+    cache.rows = cache.rows + len(X)
+    cache.unique = cache.unique + len(hashes)
+    cache.hits = cache.hits + len(hashes) - missing.size
+    return labels[inverse].astype(np.int64)
@@ -0,0 +1,277 @@
+"""
+PREDICTION SERVER
+System Log Analysis for Anomaly Detection Using Machine Learning
+MIT License
+Copyright (c) 2020 Miroslav Siklosi
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import io
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pandas as pd
+from data_preprocessing import FEATURE_COLUMNS, fit_imputer, apply_imputer, apply_reduction
+from data_output import predictions_to_labels
+from ML_modules import deepLearning, predict_classifier
+from model_bundle import MANIFEST, find_classifier, load_model_bundle
+
+# Method for loading flow records from body of the request into matrix of features
+def parse_records(body, content_type):
+    # JSON is list of rows, values of each row are in order of dataset columns
+    if content_type.startswith("application/json"):
+        rows = json.loads(body)
+        dataset = pd.DataFrame(rows)
+    # CSV has header and columns same as dataset
+    else:
+        dataset = pd.read_csv(io.BytesIO(body))
+
+    return np.ascontiguousarray(dataset.iloc[:, FEATURE_COLUMNS].to_numpy(dtype=np.float32))
+
+class ModelWorker:
+    # Keeps classifier of one ML model in memory and predicts requests
+    # collected into micro-batches in its own thread
+
+    def __init__(self, model, classifier_dir, max_batch, max_wait, reload_interval=1.0):
+        self.model = model
+        self.classifier_dir = classifier_dir
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.reload_interval = reload_interval
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+
+        # Statistics
+        self.started = time.time()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.reloads = 0
+        self.latencies = deque(maxlen=10000)
+
+        self.load()
+        self.last_check = time.time()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Method to load classifier and imputation statistics from disk
+    def load(self):
+        # Arrays of bundle are memory-mapped, so more servers share one copy of the classifier
+        bundle = load_model_bundle(self.classifier_dir, self.model)
+        filename = bundle["filename"]
+        if filename is None:
+            raise FileNotFoundError(f"Classifier for the {self.model} learning model was not found")
+
+        mtime = self.modified(filename)
+        classifier = bundle["classifier"]
+        imputer = bundle["imputer"]
+        reduction = bundle["reduction"]
+
+        with self.lock:
+            self.filename = filename
+            self.mtime = mtime
+            self.classifier = classifier
+            self.imputer = imputer
+            self.reduction = reduction
+
+    # Method to reload classifier if its file was replaced by retrained one
+    def reload_if_changed(self):
+        if time.time() - self.last_check < self.reload_interval:
+            return
+        self.last_check = time.time()
+        filename = find_classifier(self.classifier_dir, self.model)
+        if filename is not None and (filename != self.filename or self.modified(filename) != self.mtime):
+            self.load()
+            self.reloads = self.reloads + 1
+            print(f"Classifier of the {self.model} learning model reloaded from {filename}")
+
+    # Method to get modification time of the classifier, replaced bundle has new manifest
+    def modified(self, filename):
+        if os.path.isdir(filename):
+            return os.path.getmtime(os.path.join(filename, MANIFEST))
+        return os.path.getmtime(filename)
+
+    # Method to predict labels of matrix of features by loaded classifier
+    def predict(self, X):
+        with self.lock:
+            filename = self.filename
+            classifier = self.classifier
+            imputer = self.imputer
+            reduction = self.reduction
+
+        if imputer is None:
+            imputer = fit_imputer(X)
+        X = apply_imputer(X, imputer)
+        if reduction is not None:
+            X = apply_reduction(X, reduction)
+
+        return predict_classifier(classifier, self.model, X)
+
+    # Method to submit request and wait for its predictions
+    def submit(self, X):
+        request = {"X": X, "start": time.perf_counter(), "done": threading.Event()}
+        self.queue.put(request)
+        request["done"].wait()
+        if "error" in request:
+            raise RuntimeError(request["error"])
+        return request["y_pred"]
+
+    # Method collecting requests into micro-batches until batch is full
+    # or the oldest request waits for too long
+    def run(self):
+        if self.model in deepLearning:
+            # Progress bar of Keras is not printed for every micro-batch,
+            # it is switched off in the thread which predicts
+            from keras.utils import disable_interactive_logging
+            disable_interactive_logging()
+        while True:
+            requests = [self.queue.get()]
+            rows = len(requests[0]["X"])
+            deadline = time.perf_counter() + self.max_wait
+            while rows < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                rows = rows + len(request["X"])
+
+            try:
+                self.reload_if_changed()
+                y_pred = self.predict(np.concatenate([request["X"] for request in requests]))
+            except Exception as e:
+                for request in requests:
+                    request["error"] = str(e)
+                    request["done"].set()
+                continue
+
+            offset = 0
+            end = time.perf_counter()
+            for request in requests:
+                count = len(request["X"])
+                request["y_pred"] = y_pred[offset:offset + count]
+                offset = offset + count
+                self.latencies.append(end - request["start"])
+                request["done"].set()
+
+            self.requests = self.requests + len(requests)
+            self.rows = self.rows + rows
+            self.batches = self.batches + 1
+
+    # Method to count latency and throughput statistics
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        uptime = time.time() - self.started
+        return {"classifier": self.filename,
+                "requests": self.requests,
+                "rows": self.rows,
+                "batches": self.batches,
+                "reloads": self.reloads,
+                "mean_batch_rows": self.rows / self.batches if self.batches else 0.0,
+                "latency_ms_mean": float(latencies.mean()) if latencies.size else 0.0,
+                "latency_ms_p50": float(np.percentile(latencies, 50)) if latencies.size else 0.0,
+                "latency_ms_p95": float(np.percentile(latencies, 95)) if latencies.size else 0.0,
+                "latency_ms_p99": float(np.percentile(latencies, 99)) if latencies.size else 0.0,
+                "throughput_rows_per_s": self.rows / uptime if uptime else 0.0}
+
+class PredictionServer(ThreadingHTTPServer):
+    # Many clients can connect at once, requests are batched by workers
+    request_queue_size = 128
+    daemon_threads = True
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    # Handles HTTP requests
+    # POST /predict/<model> - flow records in CSV or JSON, returns labels
+    # POST /reload/<model>  - reloads classifier from disk
+    # GET  /stats           - latency and throughput statistics
+    # GET  /models          - served ML models
+
+    workers = {}
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def find_worker(self, model):
+        if model == "" and len(self.workers) == 1:
+            return next(iter(self.workers.values()))
+        return self.workers.get(model)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, {model: worker.stats() for model, worker in self.workers.items()})
+        elif self.path == "/models":
+            self.send_json(200, list(self.workers))
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/", 1)
+        command = parts[0]
+        worker = self.find_worker(parts[1] if len(parts) > 1 else "")
+        if command not in ("predict", "reload"):
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        if worker is None:
+            self.send_json(404, {"error": f"ML model is not served, served models are {list(self.workers)}"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        try:
+            if command == "reload":
+                worker.load()
+                worker.reloads = worker.reloads + 1
+                self.send_json(200, {"model": worker.model, "classifier": worker.filename})
+                return
+
+            X = parse_records(body, self.headers.get("Content-Type", "text/csv"))
+            y_pred = worker.submit(X)
+        except Exception as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(200, {"model": worker.model, "labels": predictions_to_labels(y_pred).tolist()})
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == "__main__":
+    # Create parser
+    parser = argparse.ArgumentParser(prog="prediction_server.py")
+    parser.add_argument("--models", dest="models", nargs="+", required=True)
+    parser.add_argument("--host", dest="host", default="127.0.0.1")
+    parser.add_argument("--port", dest="port", type=int, default=8000)
+    parser.add_argument("--classifiers", dest="classifier_dir", default="classifiers")
+    parser.add_argument("--max-batch", dest="max_batch", type=int, default=10000)
+    parser.add_argument("--max-wait", dest="max_wait", type=float, default=5.0)
+    args = parser.parse_args()
+
+    try:
+        for model in args.models:
+            # Maximal waiting time for micro-batch is given in milliseconds
+            PredictionHandler.workers[model] = ModelWorker(model, args.classifier_dir, args.max_batch, args.max_wait / 1000)
+    except FileNotFoundError as e:
+        print(e)
+        sys.exit(1)
+
+    server = PredictionServer((args.host, args.port), PredictionHandler)
+    print(f"Serving ML models {', '.join(args.models)} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
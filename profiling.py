@@ -0,0 +1,154 @@
+"""
+PROFILING
+System Log Analysis for Anomaly Detection Using Machine Learning
+MIT License
+Copyright (c) 2020 Miroslav Siklosi
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import cProfile
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # Peak memory is not measured on Windows
+    resource = None
+
+# Method to get peak resident memory of the process in bytes
+def peak_rss():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class Profiler:
+    # Collects wall-clock time, CPU time, peak memory and number of rows of
+    # pipeline stages, stages entered more times (e.g. for every chunk) are
+    # summed up, nothing is measured until the profiler is enabled
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.dump_stage = None
+        self.dump_profile = None
+
+    # Method to enable profiling, cProfile of the dump_stage is collected if given
+    def enable(self, dump_stage=None):
+        self.enabled = True
+        self.started = time.perf_counter()
+        self.started_cpu = time.process_time()
+        if dump_stage is not None:
+            self.dump_stage = dump_stage
+            self.dump_profile = cProfile.Profile()
+
+    # Method to measure stage, number of rows can be set in returned record
+    @contextmanager
+    def stage(self, name, rows=None):
+        if not self.enabled:
+            yield {}
+            return
+
+        record = {"rows": rows}
+        profile = self.dump_profile if name == self.dump_stage else None
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu, record["rows"])
+
+    # Method to measure stage of producing items of iterable, e.g. parsing of
+    # chunks, rows counts number of rows of the item
+    def iterate(self, name, iterable, rows=len):
+        if not self.enabled:
+            yield from iterable
+            return
+
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as record:
+                item = next(iterator, None)
+                if item is not None:
+                    record["rows"] = rows(item)
+            if item is None:
+                return
+            yield item
+
+    # Method to add measurement to the stage
+    def add(self, name, wall, cpu, rows=None):
+        stage = self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "peak_rss_bytes": 0, "rows": None})
+        stage["wall_s"] = stage["wall_s"] + wall
+        stage["cpu_s"] = stage["cpu_s"] + cpu
+        # Peak memory of the process at the end of the stage
+        stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"], peak_rss())
+        if rows is not None:
+            stage["rows"] = (stage["rows"] or 0) + rows
+
+    # Method to get measured stages with throughput and total of the whole run
+    def results(self):
+        results = {}
+        for name, stage in self.stages.items():
+            result = dict(stage)
+            result["rows_per_s"] = stage["rows"] / stage["wall_s"] if stage["rows"] is not None and stage["wall_s"] > 0 else None
+            results[name] = result
+        results["total"] = {"wall_s": time.perf_counter() - self.started,
+                            "cpu_s": time.process_time() - self.started_cpu,
+                            "peak_rss_bytes": peak_rss(), "rows": None, "rows_per_s": None}
+        return results
+
+    # Method to print measured stages in command line
+    def report(self, file=sys.stdout):
+        print(f"{'Stage':24s} {'Wall [s]':>10s} {'CPU [s]':>10s} {'Peak RSS [MB]':>14s} {'Rows':>10s} {'Rows/s':>12s}", file=file)
+        for name, stage in self.results().items():
+            rows = "-" if stage["rows"] is None else str(stage["rows"])
+            rows_per_s = "-" if stage["rows_per_s"] is None else f"{stage['rows_per_s']:.0f}"
+            print(f"{name:24s} {stage['wall_s']:10.4f} {stage['cpu_s']:10.4f} {stage['peak_rss_bytes'] / 1024**2:14.1f} {rows:>10s} {rows_per_s:>12s}", file=file)
+
+    # Method to save measured stages into JSON file
+    def save_json(self, filename, labels=None):
+        with open(filename, 'w') as f:
+            json.dump({"labels": labels or {}, "stages": self.results()}, f, indent=4)
+
+    # Method to save measured stages into Prometheus textfile, the file is
+    # replaced at once, so the collector never reads partially written file
+    def save_prometheus(self, filename, labels=None):
+        metrics = (("wall_s", "wall_seconds", "Wall-clock time of the pipeline stage"),
+                   ("cpu_s", "cpu_seconds", "CPU time of the pipeline stage"),
+                   ("peak_rss_bytes", "peak_rss_bytes", "Peak resident memory of the process at the end of the pipeline stage"),
+                   ("rows", "rows", "Rows processed by the pipeline stage"),
+                   ("rows_per_s", "rows_per_second", "Rows processed by the pipeline stage per second"))
+        results = self.results()
+        lines = []
+        for key, metric, description in metrics:
+            lines.append(f"# HELP traffic_analysis_stage_{metric} {description}")
+            lines.append(f"# TYPE traffic_analysis_stage_{metric} gauge")
+            for name, stage in results.items():
+                if stage[key] is None:
+                    continue
+                stage_labels = dict(labels or {}, stage=name)
+                label_text = ",".join(f'{label}="{value}"' for label, value in stage_labels.items())
+                lines.append(f"traffic_analysis_stage_{metric}{{{label_text}}} {stage[key]}")
+
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_filename, filename)
+
+    # Method to save cProfile statistics of the dump stage, readable by pstats,
+    # snakeviz or converted for flame graphs
+    def save_dump(self, filename):
+        if self.dump_profile is not None:
+            self.dump_profile.dump_stats(filename)
+
+# Profiler shared by all modules of the tool
+profiler = Profiler()
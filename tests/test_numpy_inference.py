@@ -0,0 +1,35 @@
+"""
+Predictions of classifiers exported for NumPy inference must be identical to
+predictions of scikit-learn and Keras on the sample dataset
+"""
+import os
+import numpy as np
+import pytest
+import ML_modules as ML
+from data_preprocessing import import_dataset
+from numpy_inference import export_network, export_forest, save_engine_arrays, load_engine
+
+SAMPLE_DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Datasets", "sample_data2.csv")
+
+@pytest.fixture(scope="module")
+def data():
+    return import_dataset(SAMPLE_DATASET, split=True, keep_dataset=False)
+
+# Method to train small classifier of ML model
+def train(model, data):
+    if model == "ANN":
+        pytest.importorskip("keras")
+        return ML.model_ANN(data, batch_size=256, epochs=2, patience=1)
+    return ML.models[model](data)
+
+@pytest.mark.parametrize("model", ["DTC", "RFC", "ANN"])
+def test_engine_predicts_same_labels(model, data, tmp_path):
+    classifier = train(model, data)
+    exported = export_network(classifier) if model == "ANN" else export_forest(classifier)
+    # Engine is saved and memory-mapped same way as in bundle of the model
+    save_engine_arrays(exported, str(tmp_path / "engine"))
+    engine = load_engine(str(tmp_path / "engine"))
+
+    y_framework = ML.predict_classifier(classifier, model, data["X_test"])
+    y_engine = ML.predict_classifier(engine, model, data["X_test"])
+    np.testing.assert_array_equal(y_engine, y_framework)
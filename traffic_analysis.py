@@ -13,14 +13,28 @@ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLI
 
 """
 import argparse
+import atexit
+import os
 import sys
+import tempfile
+import time
+from functools import partial
 import numpy as np
 import ML_modules as ML
-from joblib import dump, load
-from sklearn.metrics import confusion_matrix
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
-from data_preprocessing import import_dataset, import_unlabelled_dataset
-from keras.models import load_model
+from ML_modules import unsupervised_labels, predict_classifier
+from joblib import load
+from data_preprocessing import import_dataset, import_unlabelled_dataset, iterate_unlabelled_dataset, iterate_dataset, CACHE_SIZE
+from data_preprocessing import expand_sources, iterate_dataset_files, import_dataset_files, import_unlabelled_dataset_files
+from data_preprocessing import dataset_schema, hash_file, fit_imputer, merge_imputer, apply_imputer, spill_dataset_files
+from data_preprocessing import REDUCTION_METHODS, fit_reduction, apply_reduction
+from data_output import output_formats, output_columns, open_labelled_file, write_labelled_dataset
+from data_output import compute_metrics, save_metrics, metrics_report, write_prediction_result
+from profiling import profiler
+from flow_follower import FlowFollower, LatencyStats
+from numpy_inference import exportable, load_engine
+from prediction_cache import PredictionCache, CACHE_ENTRIES, predict_unique
+from model_bundle import save_bundle, load_manifest, update_manifest, load_bundle_classifier, load_model_bundle
+from model_bundle import dataset_fingerprint, schema_differences, library_differences
 
 # List of ML models flags for parser
 models_flags = (
@@ -35,7 +49,11 @@ models_flags = (
     "LOF",
     "K-Means",
     "HC",
-    "ANN"    
+    "ANN",
+    "ocSVM-Nystroem",
+    "LOF-Tree",
+    "HC-MB",
+    "K-NN-Tree"
 )
 
 # Create parser
@@ -43,65 +61,440 @@ parser = argparse.ArgumentParser(prog="IDS_traffic_analysis.py")
 parser.add_argument("--mode", dest="mode", choices=["research", "prod"], required=True)
 parser.add_argument("--command", dest="command", choices=["train", "predict", "trainandpredict"], required=True)
 parser.add_argument("--model", dest="model", choices=models_flags, required=True)
-parser.add_argument("--source", dest="source", required=True)
+parser.add_argument("--source", dest="source", nargs="+", required=True)
+parser.add_argument("--jobs", dest="jobs", type=int, default=None)
+parser.add_argument("--chunksize", dest="chunksize", type=int, default=None)
+parser.add_argument("--output-format", dest="output_format", choices=output_formats, default="tsv")
+parser.add_argument("--metrics-json", dest="metrics_json", default=None)
+parser.add_argument("--cache-dir", dest="cache_dir", default=None)
+parser.add_argument("--cache-size", dest="cache_size", type=int, default=CACHE_SIZE // 1024**2)
+parser.add_argument("--incremental", dest="incremental", action="store_true",
+                    help="train LR, NB, RFC or K-Means by chunks; LR and RFC replay kept flows of previous chunks, K-Means depends on order of the flows, so time-ordered datasets are best shuffled")
+parser.add_argument("--engine", dest="engine", choices=["native", "numpy"], default="native")
+parser.add_argument("--feature-reduction", dest="feature_reduction", nargs="+", choices=REDUCTION_METHODS, default=None)
+parser.add_argument("--dedup", dest="dedup", action="store_true")
+parser.add_argument("--prediction-cache", dest="prediction_cache", default=None)
+parser.add_argument("--prediction-cache-size", dest="prediction_cache_size", type=int, default=CACHE_ENTRIES)
+parser.add_argument("--follow", dest="follow", action="store_true")
+parser.add_argument("--batch-size", dest="batch_size", type=int, default=None)
+parser.add_argument("--epochs", dest="epochs", type=int, default=ML.ANN_EPOCHS)
+parser.add_argument("--patience", dest="patience", type=int, default=ML.ANN_PATIENCE)
+parser.add_argument("--poll-interval", dest="poll_interval", type=float, default=1.0)
+parser.add_argument("--profile", dest="profile", action="store_true")
+parser.add_argument("--profile-output", dest="profile_output", default=None)
+parser.add_argument("--profile-dump", dest="profile_dump", default=None)
+parser.add_argument("--profile-stage", dest="profile_stage", default="predict")
 
 args = parser.parse_args()
 
-# Definition of ML models - used in parser due to different needs of each models
-supervised = ("LR", "K-NN", "kSVM", "NB", "DTC", "RFC")
-unsupervised = ("ocSVM", "iF", "LOF", "K-Means", "HC")
-deepLearning = ("ANN")
+if args.engine == "numpy" and (args.command != "predict" or args.model not in exportable):
+    print(f"NumPy engine is possible only with command predict for the {', '.join(exportable)} learning models")
+    sys.exit(1)
+
+if args.feature_reduction is not None and args.command == "predict":
+    print("Feature reduction is fitted by command train or trainandpredict, command predict applies the reduction saved with the classifier")
+    sys.exit(1)
+
+if args.feature_reduction is not None and (args.incremental or (args.model in ML.deepLearning and args.chunksize is not None)):
+    print("Feature reduction needs whole training dataset, it is not possible with incremental training or training by chunks")
+    sys.exit(1)
+
+if args.feature_reduction is not None and "importance" in args.feature_reduction and args.model in ML.unsupervised:
+    print("Feature reduction by importance needs labels, it is not possible for unsupervised models")
+    sys.exit(1)
+
+if args.feature_reduction is not None and "pca" in args.feature_reduction and args.model in ML.hamming:
+    print(f"Feature reduction by PCA is not possible for the {', '.join(ML.hamming)} learning models, hamming metric needs original features")
+    sys.exit(1)
+
+# Persistent prediction cache is used only with deduplication
+if args.prediction_cache is not None:
+    args.dedup = True
+
+if args.dedup and (args.mode != "prod" or args.command != "predict"):
+    print("Deduplication of predicted flows is possible only with command predict in mode prod")
+    sys.exit(1)
+
+if args.prediction_cache_size <= 0:
+    print("Size of prediction cache has to be positive number of labels")
+    sys.exit(1)
+
+if args.follow and (args.mode != "prod" or args.command != "predict" or args.chunksize is not None):
+    print("Follow mode is possible only with command predict in mode prod without chunksize")
+    sys.exit(1)
+
+if args.batch_size is not None and args.batch_size <= 0:
+    print("Batch size has to be positive number of rows")
+    sys.exit(1)
+
+if args.epochs <= 0 or args.patience <= 0:
+    print("Number of epochs and patience have to be positive numbers")
+    sys.exit(1)
+
+# Sources can be files, folders with .csv files or glob patterns, followed
+# files may not exist yet
+follow_sources = args.source
+sources = expand_sources(args.source)
+if not sources and not args.follow:
+    print(f"No dataset was found in {', '.join(args.source)}")
+    sys.exit(1)
+args.source = sources[0] if sources else args.source[0]
+
+if args.chunksize is not None and args.chunksize <= 0:
+    print("Chunk size has to be positive number of rows")
+    sys.exit(1)
+
+if args.incremental and args.command != "train":
+    print("Incremental training is possible only with command train")
+    sys.exit(1)
 
-# Assigning ML models to corresponding parser flags
-models = {"LR": ML.model_LR, "K-NN": ML.model_KNN, "kSVM":  ML.model_kSVM, 
-           "NB": ML.model_NB, "DTC":  ML.model_DTC, "RFC":  ML.model_RFC, 
-           "ocSVM":  ML.model_ocSVM, "iF": ML.model_iF, "LOF": ML.model_LOF, 
-           "K-Means":  ML.model_KMeans, "HC": ML.model_HC, "ANN":  ML.model_ANN}
+if args.incremental and args.model not in ML.incremental:
+    print(f"Incremental training is not available for the {args.model} learning model, choose from {', '.join(ML.incremental)}")
+    sys.exit(1)
+
+# Number of rows in one chunk of incremental training if chunk size is not given
+INCREMENTAL_CHUNKSIZE = 100000
+
+# Number of rows labelled at once in follow mode if batch size is not given
+FOLLOW_BATCH_SIZE = 1000
+
+# Folder of saved classifiers
+CLASSIFIER_DIR = "classifiers"
+
+# Size limit of the dataset cache is given in megabytes
+cache_size = args.cache_size * 1024**2
+
+# Method to report measured stages when the tool exits
+def report_profile():
+    labels = {"mode": args.mode, "command": args.command, "model": args.model}
+    print(f"Profile of Machine Learning model {args.model}:")
+    profiler.report()
+    if args.profile_output is not None:
+        if args.profile_output.lower().endswith(".json"):
+            profiler.save_json(args.profile_output, labels)
+        else:
+            profiler.save_prometheus(args.profile_output, labels)
+        print(f"Profile saved into {args.profile_output}")
+    if args.profile_dump is not None:
+        profiler.save_dump(args.profile_dump)
+        print(f"cProfile statistics of stage {args.profile_stage} saved into {args.profile_dump}")
+
+# Stages of the pipeline are measured only if profiling was requested
+if args.profile or args.profile_output is not None or args.profile_dump is not None:
+    profiler.enable(args.profile_stage if args.profile_dump is not None else None)
+    atexit.register(report_profile)
+
+# Definition of ML models - used in parser due to different needs of each models
+supervised = ML.supervised
+unsupervised = ML.unsupervised
+deepLearning = ML.deepLearning
+models = ML.models
+detectors = ML.detectors
+incremental = ML.incremental
 
 # Method to print metrics in command line
 def print_metrics(model, data, y_pred):
-    # accuracy: (tp + tn) / (p + n)
-    accuracy = accuracy_score(data["y_test"], y_pred)
-    print(f"Accuracy of Machine Learning model {model} is", accuracy)
-    # precision tp / (tp + fp)
-    precision = precision_score(data["y_test"], y_pred)
-    print(f"Precision of Machine Learning model {model} is", precision)
-    # recall: tp / (tp + fn)
-    recall = recall_score(data["y_test"], y_pred)
-    print(f"Recall of Machine Learning model {model} is", recall)
-    # f1: 2 tp / (2 tp + fp + fn)
-    f1 = f1_score(data["y_test"], y_pred)
-    print(f"F1-Score of Machine Learning model {model} is", f1)
+    # Confusion matrix is counted once and all metrics are derived from it
+    metrics = compute_metrics(data["y_test"], y_pred)
+    print(f"Confusion Matrix of Machine Learning model {model}:")
+    print(metrics["confusion_matrix"])
+    print(f"Accuracy of Machine Learning model {model} is", metrics["accuracy"])
+    print(f"Precision of Machine Learning model {model} is", metrics["precision"])
+    print(f"Recall of Machine Learning model {model} is", metrics["recall"])
+    print(f"F1-Score of Machine Learning model {model} is", metrics["f1"])
+    
+    if args.metrics_json is not None:
+        save_metrics(args.metrics_json, model, metrics)
+        print(f"Metrics saved into {args.metrics_json}")
+    return metrics
 
 # Method to print Prediction results into the text file
-def print_prediction_result(data, y_pred, input_filepath):
-    # [X_test, y_pred] Prediction is correct/Prediction is NOT correct
-    y_test = data['y_test']
-    
-    np.set_printoptions(threshold=np.inf, linewidth=np.inf)
-    with open(f"Results/prediction_result.csv", 'w') as f:
-        with open(input_filepath) as input_file:
-            for index, input_line in enumerate(input_file):
-                if index == 0:
-                    continue
-                i = index - 1
-                f.write(f"{input_line.rstrip()}, {y_pred[i]}, ")
-                if y_test[i] == y_pred[i]:
-                    f.write("Prediction is correct\n")
-                else:
-                    f.write("Prediction is NOT correct\n")
+def print_prediction_result(data, y_pred):
+    with profiler.stage("write_output", len(y_pred)):
+        write_prediction_result("Results/prediction_result.csv", data["dataset"], data["y_test"], y_pred)
     print(f"Prediction results saved into prediction_result.csv")
     
-# Method for saving ML weights (classifier)
-def save_classifier(classifier, model):
-    if model in supervised:
-        output_filename = f"classifiers/classifier_{model}.joblib"
-        dump(classifier, output_filename)
-    elif model in deepLearning:
-        output_filename = f"classifiers/classifier_{model}.h5"
-        classifier.save(output_filename)
+# Method to find saved ML model, current version of its bundle is resolved
+# once, so manifest, imputation statistics, feature reduction and classifier
+# of one command belong together even if the model is retrained meanwhile.
+# Classifier file saved by older versions is used if bundle was not saved
+def find_saved_model(model):
+    try:
+        return load_model_bundle(CLASSIFIER_DIR, model, args.engine, classifier=False)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+# Method to check if classifier of ML model was saved
+def has_classifier(saved):
+    return saved["filename"] is not None
+
+# Method to fit supervised or deep learning model, neural network is trained
+# with parameters given by arguments and checkpoint saved next to the classifier,
+# checkpoint is resumed only by training on the same datasets split the same way
+def fit_classifier(model, data):
+    if model in deepLearning:
+        checkpoint_key = {"command": args.command, "chunksize": args.chunksize,
+                          "feature_reduction": args.feature_reduction, "training": dataset_fingerprint(sources)}
+        return models[model](data, batch_size=args.batch_size or ML.ANN_BATCH_SIZE, epochs=args.epochs, 
+                             patience=args.patience, checkpoint=f"{CLASSIFIER_DIR}/classifier_{model}.checkpoint.h5",
+                             checkpoint_key=checkpoint_key)
+    return models[model](data)
+
+# Method to train neural network on dataset files read by chunks, cleaned
+# chunks are kept in temporary folder (in cache folder if given) during training
+def train_by_chunks(model):
+    if args.cache_dir is not None:
+        os.makedirs(args.cache_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=args.cache_dir) as folder:
+        data = spill_dataset_files(sources, args.chunksize, folder, ML.ANN_VALIDATION_SPLIT)
+        with profiler.stage("fit", data["samples"]):
+            classifier = fit_classifier(model, data)
+    return classifier, data["imputer"]
+
+# Labels of predicted feature vectors, created by command predict in mode prod
+# if deduplication was requested
+prediction_cache = None
+
+# Method to create prediction cache for saved classifier, statistics are
+# printed and persistent cache is saved when the tool exits
+def open_prediction_cache(saved):
+    global prediction_cache
+    if saved["manifest"] is not None:
+        version = saved["manifest"]["version"]
+    elif has_classifier(saved):
+        version = hash_file(saved["filename"])
+    else:
+        return
+    prediction_cache = PredictionCache(args.prediction_cache, version, args.prediction_cache_size)
+    atexit.register(close_prediction_cache)
+
+# Method to print statistics of deduplication and save persistent cache
+def close_prediction_cache():
+    print_prediction_cache(prediction_cache.summary())
+    prediction_cache.save()
+    if args.prediction_cache is not None:
+        print(f"Prediction cache saved into {args.prediction_cache}")
+
+# Method to print statistics of deduplication in command line
+def print_prediction_cache(summary):
+    print(f"Unique feature vectors: {summary['unique']} of {summary['rows']} flows ({summary['unique_rate']:.1%}), "
+          f"cache hits: {summary['hits']} ({summary['hit_rate']:.1%}), predicted: {summary['predicted']}, cached labels: {summary['entries']}")
+
+# Feature reduction saved with the classifier, loaded by command predict
+reduction = None
+
+# Method to fit feature reduction on the training set and apply it to the
+# imported dataset, labels are None for unsupervised models
+def reduce_features(data, y):
+    with profiler.stage("feature_reduction", len(data["X_train"])):
+        fitted = fit_reduction(data["X_train"], y, args.feature_reduction)
+        n_features = data["X_train"].shape[1]
+        for name in ("X_train", "X_test"):
+            data[name] = apply_reduction(data[name], fitted)
+    components = f" into {data['X_train'].shape[1]} principal components" if fitted["pca"] is not None else ""
+    print(f"Feature reduction ({' '.join(args.feature_reduction)}) kept {len(fitted['columns'])} of {n_features} features{components}")
+    return fitted
+
+# Method to predict labels by loaded classifier, only unique feature vectors
+# which are not cached are predicted if deduplication was requested
+def predict_labels(classifier, model, X):
+    if reduction is not None:
+        with profiler.stage("feature_reduction", len(X)):
+            X = apply_reduction(X, reduction)
+    if prediction_cache is None:
+        return predict_classifier(classifier, model, X)
+    return predict_unique(classifier, model, X, prediction_cache)
+
+# Method to predict labels by unsupervised model, trained detector is used
+# if it was saved, otherwise the model is fitted on predicted dataset
+def predict_unsupervised(model, data, saved):
+    if has_classifier(saved):
+        detector = load_classifier(saved["filename"], saved["manifest"])
+        return predict_labels(detector, model, data["X_test"])
+    with profiler.stage("fit_predict", len(data["X_test"])):
+        return unsupervised_labels(models[model](data))
+
+# Method for saving ML weights (classifier) into bundle of the model together
+# with imputation statistics, columns and fingerprint of training datasets.
+# Link of the bundle is replaced at once, so incremental checkpoint is never
+# lost by interrupted saving. Incremental training keeps fingerprints of
+# datasets of the saved model it continued from
+def save_classifier(classifier, model, imputer=None, trained_sources=(), timing=None, reduction=None, saved=None):
+    features = dataset_schema(trained_sources[0], [])["features"] if trained_sources else None
+    if reduction is not None and features is not None:
+        # Names of kept features for readers of the manifest
+        reduction = dict(reduction, features=[features[column] for column in reduction["columns"]])
+    training = dataset_fingerprint(trained_sources)
+    if args.incremental and saved is not None and saved["manifest"] is not None:
+        # Incremental training keeps fingerprints of datasets of previous runs
+        previous = saved["manifest"]["training"]
+        training = [source for source in previous if source not in training] + training
+    
+    with profiler.stage("save_classifier"):
+        output_filename = save_bundle(CLASSIFIER_DIR, model, classifier, model in deepLearning, imputer, features, training, timing, reduction)
     return output_filename
 
+# Method to verify that datasets have same feature columns as the training
+# dataset of the saved bundle
+def verify_classifier_schema(model, saved):
+    manifest = saved["manifest"]
+    if manifest is None:
+        return
+    for source in sources:
+        differences = schema_differences(manifest, dataset_schema(source, [])["features"])
+        if differences:
+            print(f"Feature columns of {source} differ from the training dataset of the {model} learning model: {'; '.join(differences[:5])}")
+            sys.exit(1)
+
+# Method to save metrics of the evaluated classifier into its bundle
+def save_classifier_metrics(model, metrics, saved):
+    if saved["manifest"] is not None:
+        report = dict(metrics_report(model, metrics), dataset=dataset_fingerprint(sources), 
+                      evaluated=time.strftime("%Y-%m-%dT%H:%M:%S%z"))
+        # Metrics belong to the evaluated version even if it was replaced meanwhile
+        update_manifest(saved["filename"], metrics=report)
+
+# Method to get names of labelled datasets of more sources, files with same
+# name in different folders (e.g. per-day folders of a collector) are named
+# by their path relative to the common folder of all sources
+def labelled_names(filenames):
+    names = [os.path.splitext(os.path.basename(filename))[0] for filename in filenames]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        common = os.path.commonpath([os.path.dirname(os.path.abspath(filename)) for filename in filenames])
+        names = [os.path.splitext(os.path.relpath(os.path.abspath(filename), common))[0].replace(os.sep, "_")
+                 if name in duplicates else name for filename, name in zip(filenames, names)]
+    if len(set(names)) < len(names):
+        print(f"Labelled datasets of sources {', '.join(filenames)} would overwrite each other...exiting")
+        sys.exit(1)
+    return dict(zip(filenames, names))
+
+# Method to get filename of labelled dataset, every file of more sources
+# is labelled into its own file
+def labelled_filename(model, source):
+    if len(sources) == 1:
+        return f"Results/{model}_labelled.csv"
+    return f"Results/{model}_{labelled_names(sources)[source]}_labelled.csv"
+
+# Method to import labelled dataset from one or more sources
+def import_sources(split, keep_dataset=True):
+    if len(sources) == 1:
+        return import_dataset(sources[0], split=split, cache_dir=args.cache_dir, cache_size=cache_size, keep_dataset=keep_dataset)
+    return import_dataset_files(sources, split, args.jobs, keep_dataset)
+
+# Method to predict more dataset files parsed in parallel, labelled dataset
+# is saved for every file
+def predict_dataset_files(imputer, saved):
+    files = iterate_dataset_files(sources, args.jobs, output_columns[args.output_format])
+    files = profiler.iterate("read_csv", files, rows=lambda file: len(file["X"]))
+    fitted = args.model in unsupervised and not has_classifier(saved)
+    if imputer is None or fitted:
+        # Imputation statistics and unsupervised models which were not
+        # trained need all files at once
+        files = list(files)
+        if imputer is None:
+            imputer = merge_imputer([file["statistics"] for file in files])
+    
+    if fitted:
+        X_test = apply_imputer(np.concatenate([file["X"] for file in files]), imputer)
+        y_pred = predict_unsupervised(args.model, {"X_test": X_test}, saved)
+        predictions = np.split(y_pred, np.cumsum([len(file["X"]) for file in files])[:-1])
+    else:
+        classifier = load_classifier(saved["filename"], saved["manifest"])
+    
+    for i, file in enumerate(files):
+        if fitted:
+            y_pred = predictions[i]
+        else:
+            y_pred = predict_labels(classifier, args.model, apply_imputer(file["X"], imputer))
+        output_filename = labelled_filename(args.model, file["filename"])
+        with open_labelled_file(output_filename) as f:
+            with profiler.stage("write_output", len(y_pred)):
+                write_labelled_dataset(f, file["dataset"], y_pred, args.output_format, header=True)
+        print(f"Labelled dataset printed out to {output_filename}")
+
+# Method to label new flows appended to followed files until interrupted,
+# labels are appended to the labelled dataset of followed flows
+def follow_dataset_files(imputer, saved):
+    if args.model in unsupervised and not has_classifier(saved):
+        print("Unsupervised models which were not trained need whole dataset, follow mode is not possible...exiting")
+        sys.exit(1)
+    
+    classifier = load_classifier(saved["filename"], saved["manifest"])
+    # Values of followed flows are kept as they were written, so they are
+    # labelled into their own file, not into the file of one-shot prediction
+    # formatted by types of the whole dataset
+    output_filename = f"Results/{args.model}_followed.csv"
+    follower = FlowFollower(follow_sources, f"Results/{args.model}_followed.offsets.json", output_columns[args.output_format], args.batch_size or FOLLOW_BATCH_SIZE)
+    stats = LatencyStats()
+    last_report = time.time()
+    print(f"Following {', '.join(follow_sources)}, labelled flows are appended to {output_filename}")
+    
+    with open_labelled_file(output_filename, 'a') as f:
+        try:
+            while True:
+                batches = follower.poll()
+                for batch in batches:
+                    # Without saved imputation statistics they are counted on every batch
+                    X_test = apply_imputer(batch["X_test"], imputer or fit_imputer(batch["X_test"]))
+                    y_pred = predict_labels(classifier, args.model, X_test)
+                    with profiler.stage("write_output", len(y_pred)):
+                        write_labelled_dataset(f, batch["dataset"], y_pred, args.output_format, header=(f.tell() == 0))
+                        f.flush()
+                    follower.commit(batch)
+                    stats.add(batch, time.time())
+                
+                if time.time() - last_report >= 10:
+                    print_latency(stats.summary())
+                    if prediction_cache is not None:
+                        print_prediction_cache(prediction_cache.summary())
+                        prediction_cache.save()
+                    last_report = time.time()
+                if not batches:
+                    time.sleep(args.poll_interval)
+        except KeyboardInterrupt:
+            print_latency(stats.summary())
+
+# Method to print latency of labelled flows in command line
+def print_latency(summary):
+    if not summary["rows"]:
+        print("No flows were labelled yet")
+        return
+    print(f"Labelled {summary['rows']} flows ({summary['rows_per_s']:.1f} flows/s), "
+          f"latency p50 {summary['latency_ms_p50']:.1f} ms, p95 {summary['latency_ms_p95']:.1f} ms, p99 {summary['latency_ms_p99']:.1f} ms, "
+          f"processing p50 {summary['processing_ms_p50']:.1f} ms, p99 {summary['processing_ms_p99']:.1f} ms")
+
+# Method to train ML model by chunks of the dataset, training continues from
+# the given classifier or from the saved classifier if it was trained
+# incrementally before
+def train_incremental(model, source, saved, classifier=None, imputer=None):
+    if classifier is None and has_classifier(saved):
+        # Classifier is trained further, so it is not memory-mapped read-only
+        classifier = load_classifier(saved["filename"], saved["manifest"], mmap=False)
+        if not hasattr(classifier, "partial_fit"):
+            print(f"Saved classifier of the {model} learning model was not trained incrementally, remove it to start incremental training...exiting")
+            sys.exit(1)
+        # Imputation statistics of the first training dataset are reused
+        imputer = saved["imputer"]
+    elif classifier is None:
+        classifier = incremental[model]()
+    
+    chunksize = args.chunksize or INCREMENTAL_CHUNKSIZE
+    if model in unsupervised: # Unsupervised, fitted on baseline traffic without labels
+        for data in iterate_unlabelled_dataset(source, chunksize, imputer, keep_columns=[]):
+            with profiler.stage("partial_fit", len(data["X_test"])):
+                classifier.partial_fit(data["X_test"])
+            imputer = data["imputer"]
+    else:
+        for data in iterate_dataset(source, chunksize, imputer):
+            with profiler.stage("partial_fit", len(data["X_train"])):
+                classifier.partial_fit(data["X_train"], data["y_train"])
+            imputer = data["imputer"]
+    
+    print(f"Classifier of the {model} learning model trained on {classifier.samples} flows in {classifier.chunks} chunks")
+    return classifier, imputer
+
 # Verify if dataset to import is in correct format
 def is_dataset_source(filename):
     filename = filename.lower()
@@ -113,22 +506,59 @@ def is_dataset_source(filename):
         print(f"Invalid file extension on file {filename}")
         sys.exit(1)
 
-# Method to load saved ML weight file (classifier)        
-def load_classifier(filename):
+# Verify that all sources are datasets
+def verify_dataset_sources():
+    for source in sources:
+        if not is_dataset_source(source):
+            print(f"{source} is not dataset with extension .csv")
+            sys.exit(1)
+
+# Method to load saved ML weight file (classifier), arrays of classifier saved
+# in bundle are memory-mapped unless mmap is False, manifest of the bundle is
+# passed if it was already read
+def load_classifier(filename, manifest=None, mmap=True):
+    if filename is None:
+        print(f"Classifier of the {args.model} learning model was not found!")
+        sys.exit(1)
     filepath = filename.lower()
     try:
-        if filepath.endswith(".joblib"):
-            if args.model not in supervised:
+        if os.path.isdir(filename):
+            try:
+                manifest = manifest or load_manifest(filename)
+            except ValueError as e:
+                print(e)
+                sys.exit(1)
+            if manifest["model"] != args.model:
                 print(f"Invalid classifier type for the {args.model} learning model")
                 sys.exit(1)
+            for difference in library_differences(manifest):
+                print(f"Warning: classifier is loaded by {difference}")
             
-            return load(filename)
+            with profiler.stage("load_classifier"):
+                try:
+                    return load_bundle_classifier(filename, manifest, args.engine, mmap)
+                except ValueError as e:
+                    print(e)
+                    sys.exit(1)
+        elif filepath.endswith(".joblib"):
+            if args.model not in supervised and args.model not in unsupervised:
+                print(f"Invalid classifier type for the {args.model} learning model")
+                sys.exit(1)
+            
+            with profiler.stage("load_classifier"):
+                return load(filename)
         elif filepath.endswith(".h5"):
             if args.model not in deepLearning:
                 print(f"Invalid classifier type for the {args.model} learning model")
                 sys.exit(1)
             
-            return load_model(filename)
+            with profiler.stage("load_classifier"):
+                # Keras is imported only when neural network is loaded
+                from keras.models import load_model
+                return load_model(filename)
+        elif filepath.endswith(".npz"):
+            with profiler.stage("load_classifier"):
+                return load_engine(filename)
         else:
             print("Classifier with unknown extension")
             sys.exit(1)
@@ -137,152 +567,141 @@ def load_classifier(filename):
         sys.exit(1)
 
 # PARSER
-if args.mode == "research": # RESEARCH MODE
-    if args.command == "train": # TRAIN
-        if args.model in unsupervised:
-            print("Unsupervised does not need training...exiting")
+if args.command == "train": # TRAIN
+    dataset_source = is_dataset_source(args.source)
+    if len(sources) > 1:
+        verify_dataset_sources()
+    imputer = None
+    fitted_reduction = None
+    saved = find_saved_model(args.model)
+    started = time.perf_counter()
+    if dataset_source and args.incremental: # Incremental, by chunks
+        # Classifier is saved after every file, so next file continues from it
+        classifier = None
+        for i, source in enumerate(sources):
+            classifier, imputer = train_incremental(args.model, source, saved, classifier, imputer)
+            if i < len(sources) - 1 and classifier.chunks > 0:
+                save_classifier(classifier, args.model, imputer, sources[:i + 1], {"train_s": time.perf_counter() - started}, saved=saved)
+        # Classifier without trees or statistics is never saved
+        if classifier.chunks == 0:
+            reason = "Random Forest needs flows of both classes" if isinstance(classifier, ML.IncrementalForest) else "datasets have no flows"
+            print(f"Classifier of the {args.model} learning model was not trained, {reason}...exiting")
             sys.exit(1)
-        
-        dataset_source = is_dataset_source(args.source)
-        if dataset_source:
-            data = import_dataset(args.source, split=False)
-            model = models[args.model]
+    elif dataset_source and args.model in deepLearning and args.chunksize is not None: # Neural network, by chunks
+        verify_dataset_sources()
+        classifier, imputer = train_by_chunks(args.model)
+    elif dataset_source:
+        if args.model in unsupervised: # Unsupervised, fitted on baseline traffic without labels
+            if len(sources) == 1:
+                data = import_unlabelled_dataset(args.source, keep_columns=[])
+            else:
+                data = import_unlabelled_dataset_files(sources, jobs=args.jobs)
+            data["X_train"] = data["X_test"]
+            model = detectors[args.model]
+        else:
+            data = import_sources(split=False, keep_dataset=False)
+            model = partial(fit_classifier, args.model)
+        if args.feature_reduction is not None:
+            fitted_reduction = reduce_features(data, None if args.model in unsupervised else data["y_train"])
+        with profiler.stage("fit", len(data["X_train"])):
             classifier = model(data)
-        else: # Classifier
-            classifier = load_classifier(args.source)
-        output_filename = save_classifier(classifier, args.model)
-        print(f"Trained classifier saved into file {output_filename}")
-    
-    elif args.command == "predict": # PREDICT
-        if not is_dataset_source(args.source):
-            print(f"{args.source} is not dataset with extension .csv")
-            sys.exit(1)
+        imputer = data["imputer"]
+    else: # Classifier saved by older versions, imputation statistics saved with it are kept
+        classifier = load_classifier(args.source)
+        imputer = saved["imputer"]
+    trained_sources = sources if dataset_source else []
+    output_filename = save_classifier(classifier, args.model, imputer, trained_sources, {"train_s": time.perf_counter() - started}, fitted_reduction, saved)
+    print(f"Trained classifier saved into bundle {output_filename}")
+
+elif args.mode == "research": # RESEARCH MODE
+    if args.command == "predict": # PREDICT
+        verify_dataset_sources()
+        saved = find_saved_model(args.model)
+        verify_classifier_schema(args.model, saved)
+        reduction = saved["reduction"]
     
-        data = import_dataset(args.source, split=False)
+        data = import_sources(split=False)
         if args.model in unsupervised: # Unsupervised
-            model = models[args.model]
-            y_pred = model(data)
-            
-            if args.model == "ocSVM" or "iF":
-                for i, row in enumerate(y_pred):                    
-                    if y_pred[i] == 1:
-                        y_pred[i] = 0
-                    else:
-                        y_pred[i] = 1
-        
-            # Print results
-            print(f"Confusion Matrix of Machine Learning model {args.model}:")
-            print(confusion_matrix(data["y_test"], y_pred))
-            print_metrics(args.model, data, y_pred)
-            print_prediction_result(data, y_pred, args.source) 
-            
+            y_pred = predict_unsupervised(args.model, data, saved)
         else: # Supervised, Deep Learning
-            if args.model in deepLearning: # Deep Learning
-                classifier = load_classifier(f"classifiers/classifier_{args.model}.h5")
-                y_pred = classifier.predict(data["X_test"])
-                y_pred = (y_pred > 0.5)
-                # Invert back to numbers
-                y_pred = np.argmax(y_pred, axis = 1)
-            else:
-                classifier = load_classifier(f"classifiers/classifier_{args.model}.joblib")
-                y_pred = classifier.predict(data["X_test"])
-                
-            # Print results
-            print(f"Confusion Matrix of Machine Learning model {args.model}:")
-            print(confusion_matrix(data["y_test"], y_pred))
-            print_metrics(args.model, data, y_pred)
-            print_prediction_result(data, y_pred, args.source) 
+            classifier = load_classifier(saved["filename"], saved["manifest"])
+            y_pred = predict_labels(classifier, args.model, data["X_test"])
+            
+        # Print results, metrics are saved into bundle of the classifier
+        metrics = print_metrics(args.model, data, y_pred)
+        save_classifier_metrics(args.model, metrics, saved)
+        print_prediction_result(data, y_pred)
             
     else: # TRAIN AND PREDICT
-        if not is_dataset_source(args.source):
-                print(f"{args.source} is not dataset with extension .csv")
-                sys.exit(1)
+        verify_dataset_sources()
 
         if args.model in unsupervised: # Unsupervised
-            data = import_dataset(args.source, split=False)
+            data = import_sources(split=False, keep_dataset=False)
+            if args.feature_reduction is not None:
+                reduce_features(data, None)
             model = models[args.model]
-            y_pred = model(data)
-            
-            if args.model == "ocSVM" or "iF":
-                for i, row in enumerate(y_pred):                    
-                    if y_pred[i] == 1:
-                        y_pred[i] = 0
-                    else:
-                        y_pred[i] = 1
-        
-            # Print results
-            print(f"Confusion Matrix of Machine Learning model {args.model}:")
-            print(confusion_matrix(data["y_test"], y_pred))
-            print_metrics(args.model, data, y_pred)
+            with profiler.stage("fit_predict", len(data["X_test"])):
+                y_pred = unsupervised_labels(model(data))
                                 
         else: # Supervised, Deep Learning
-            data = import_dataset(args.source, split=True)
-            model = models[args.model]
-            classifier = model(data) 
-            y_pred = classifier.predict(data["X_test"])
- 
-            if args.model in deepLearning: # Deep Learning
-                y_pred = (y_pred > 0.5)
-                # Invert back to numbers
-                y_pred = np.argmax(y_pred, axis = 1)
+            data = import_sources(split=True, keep_dataset=False)
+            if args.feature_reduction is not None:
+                reduce_features(data, data["y_train"])
+            with profiler.stage("fit", len(data["X_train"])):
+                classifier = fit_classifier(args.model, data)
+            y_pred = predict_classifier(classifier, args.model, data["X_test"])
             
-            # Print results
-            print(f"Confusion Matrix of Machine Learning model {args.model}:")
-            print(confusion_matrix(data["y_test"], y_pred))
-            print_metrics(args.model, data, y_pred)
+        # Print results
+        print_metrics(args.model, data, y_pred)
             
 else: # PRODUCTION MODE
-    if args.command == "train": # TRAIN
-        if args.model in unsupervised:
-            print("Unsupervised does not need training...exiting")
-            sys.exit(1)
+    if args.command == "predict": # PREDICT
+        # Reuse imputation statistics of the training dataset if available
+        saved = find_saved_model(args.model)
+        imputer = saved["imputer"]
+        reduction = saved["reduction"]
         
-        dataset_source = is_dataset_source(args.source)
-        if dataset_source:
-            data = import_dataset(args.source, split=False)
-            model = models[args.model]
-            classifier = model(data)
-        else: # Classifier
-            classifier = load_classifier(args.source)
-        output_filename = save_classifier(classifier, args.model)
-        print(f"Trained classifier saved into file {output_filename}")
-    
-    elif args.command == "predict": # PREDICT
-        if not is_dataset_source(args.source):
-            print(f"{args.source} is not dataset with extension .csv")
-            sys.exit(1)
-    
-        data = import_unlabelled_dataset(args.source) 
-        if args.model in unsupervised: # Unsupervised
-            model = models[args.model]
-            y_pred = model(data)
-            
-            if args.model == "ocSVM" or "iF":
-                for i, row in enumerate(y_pred):                    
-                    if y_pred[i] == 1:
-                        y_pred[i] = 0
-                    else:
-                        y_pred[i] = 1
+        if args.dedup: # Only unique feature vectors are predicted
+            open_prediction_cache(saved)
+        
+        if args.follow: # Following files which are still written
+            follow_dataset_files(imputer, saved)
+            sys.exit(0)
+        
+        verify_dataset_sources()
+        verify_classifier_schema(args.model, saved)
+        
+        if args.chunksize is not None: # Streaming prediction by chunks
+            if args.model in unsupervised and not has_classifier(saved):
+                print("Unsupervised models which were not trained need whole dataset, streaming prediction is not possible...exiting")
+                sys.exit(1)
             
+            classifier = load_classifier(saved["filename"], saved["manifest"])
+            for source in sources:
+                output_filename = labelled_filename(args.model, source)
+                with open_labelled_file(output_filename) as f:
+                    for i, data in enumerate(iterate_unlabelled_dataset(source, args.chunksize, imputer, output_columns[args.output_format])):
+                        y_pred = predict_labels(classifier, args.model, data["X_test"])
+                        with profiler.stage("write_output", len(y_pred)):
+                            write_labelled_dataset(f, data["dataset"], y_pred, args.output_format, header=(i == 0))
+                print(f"Labelled dataset printed out to {output_filename}")
+            sys.exit(0)
+        
+        if len(sources) > 1: # More files, parsed in parallel
+            predict_dataset_files(imputer, saved)
+            sys.exit(0)
+        
+        data = import_unlabelled_dataset(args.source, imputer, output_columns[args.output_format])
+        if args.model in unsupervised: # Unsupervised
+            y_pred = predict_unsupervised(args.model, data, saved)
         else: # Supervised, Deep Learning
-            if args.model in deepLearning:
-                classifier = load_classifier(f"classifiers/classifier_{args.model}.h5")
-                y_pred = classifier.predict(data["X_test"])
-                y_pred = (y_pred > 0.5)
-                # Invert back to numbers
-                y_pred = np.argmax(y_pred, axis = 1)
-            else:
-                classifier = load_classifier(f"classifiers/classifier_{args.model}.joblib")
-                y_pred = classifier.predict(data["X_test"])
-
-        labelled_dataset = np.c_[data["dataset"], ["Anomaly" if val else "Not anomaly" for val in y_pred]]
-        np.set_printoptions(threshold=np.inf)
-        with open(f"Results/{args.model}_labelled.csv", 'w') as f:
-            for row in labelled_dataset:
-                row = np.array(list(map(lambda s: s, row)))
-                r = np.array2string(row, separator='\t ', max_line_width=np.inf, formatter={'str_kind': lambda x: x})
-                f.write(f"{r[1:-1]}\n")
+            classifier = load_classifier(saved["filename"], saved["manifest"])
+            y_pred = predict_labels(classifier, args.model, data["X_test"])
+
+        with open_labelled_file(f"Results/{args.model}_labelled.csv") as f:
+            with profiler.stage("write_output", len(y_pred)):
+                write_labelled_dataset(f, data["dataset"], y_pred, args.output_format, header=True)
         print(f"Labelled dataset printed out to Results/{args.model}_labelled.csv")
     else: # TRAIN AND PREDICT
         print("Train and predict is possible only in research mode")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)